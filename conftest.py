@@ -4,10 +4,20 @@ import pytest
 from rest_framework.test import APIClient
 
 from authentication.models import User
+from core.routers import ReplicaHealth
 from utilities.models import Currency
 from wallets.models import Tier, TierCurrencyLimit, Wallet
 
 
+# --- Routing Fixtures ---
+@pytest.fixture(autouse=True)
+def healthy_replica():
+    """
+    Reads go to the replica as they do in production once the lag probe has reported.
+    """
+    ReplicaHealth.record(lag=0.0)
+
+
 # --- Client Fixtures ---
 @pytest.fixture
 def client():
@@ -1,7 +1,81 @@
-from rest_framework import serializers
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import QuerySet
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
 
+from utils.orm_utils import path_tree
 
-class BaseModelSerializer(serializers.ModelSerializer):
+_FROM_REQUEST = object()
+
+
+class SparseFieldsMixin:
+    """
+    Limits the output to the fields picked with ``?fields=`` and exposes the ``?expand=`` tree, dotted
+    paths like ``user.phone_number`` reach into nested serializers. Serializers nested by hand get
+    their part of both trees through the ``fields`` and ``expand`` arguments, see ``nested_options``.
+    """
+
+    def __init__(self, *args, fields=_FROM_REQUEST, expand=_FROM_REQUEST, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._field_tree = fields
+        self._expand_tree = expand
+
+    def _is_root(self) -> bool:
+        parent = self.parent.parent if isinstance(self.parent, serializers.ListSerializer) else self.parent
+        return parent is None
+
+    def _request_tree(self, param: str) -> dict:
+        request = self.context.get('request')
+        if request is None or not self._is_root():
+            return None
+        return path_tree(getattr(request, 'query_params', {}).get(param)) or None
+
+    @property
+    def field_tree(self) -> dict:
+        if self._field_tree is _FROM_REQUEST:
+            # the fields of a serializer being written to are never pruned
+            self._field_tree = None if hasattr(self, 'initial_data') else self._request_tree('fields')
+        return self._field_tree
+
+    @property
+    def expand_tree(self) -> dict:
+        if self._expand_tree is _FROM_REQUEST:
+            self._expand_tree = self._request_tree('expand')
+        return self._expand_tree
+
+    def is_requested(self, name: str) -> bool:
+        return not self.field_tree or name in self.field_tree
+
+    def is_expanded(self, name: str) -> bool:
+        return name in (self.expand_tree or {}) and self.is_requested(name)
+
+    def nested_options(self, name: str) -> dict:
+        """
+        Arguments for a serializer of the ``name`` relation, built by hand in ``to_representation``.
+        """
+        return {
+            'context': self.context,
+            'fields': (self.field_tree or {}).get(name) or None,
+            'expand': (self.expand_tree or {}).get(name) or None,
+        }
+
+    def get_fields(self):
+        fields = super().get_fields()
+        tree = self.field_tree
+        # a selection naming none of the fields is ignored, as query_optimizer ignores it
+        if not tree or not tree.keys() & fields.keys():
+            return fields
+        for name in list(fields):
+            if name not in tree:
+                del fields[name]
+                continue
+            nested = getattr(fields[name], 'child', fields[name])
+            if tree[name] and isinstance(nested, SparseFieldsMixin):
+                nested._field_tree = tree[name]
+        return fields
+
+
+class BaseModelSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     def update(self, instance, validated_data):
         if hasattr(instance, 'last_updated_by'):
             validated_data['last_updated_by'] = self.context['request'].user
@@ -61,3 +135,120 @@ class BaseSerializer(serializers.Serializer):
             'message': 'Validation failed',
             'errors': formatted_errors,
         }
+
+
+class CompiledListSerializer:
+    """
+    Read-only stand-in for ``many=True`` serialization of a ``ModelSerializer`` that works on
+    ``values()`` rows and produces the very same output. Every readable field is compiled once into
+    the column it reads and a converter, most columns pass through untouched and decimals and
+    datetimes are formatted in the same pass, without building model instances or going through
+    the field machinery per row.
+
+    Serializers adjusting values in ``to_representation`` do the same for rows in ``represent_values``.
+    """
+
+    # fields whose to_representation returns column values from the database as they are
+    PASSTHROUGH_FIELDS = (
+        serializers.BooleanField,
+        serializers.CharField,
+        serializers.ChoiceField,
+        serializers.IntegerField,
+        serializers.PrimaryKeyRelatedField,
+    )
+
+    def __init__(self, serializer, fields: list, columns: list):
+        self.serializer = serializer
+        self.fields = fields
+        self.columns = columns
+        self.instance = None
+
+    @classmethod
+    def compile(cls, serializer):
+        """
+        Compile the readable fields of ``serializer``, ``None`` when one of them doesn't read a plain column.
+        """
+        model = serializer.Meta.model
+        fields, columns = [], [model._meta.pk.name]
+        for field in serializer._readable_fields:
+            if isinstance(field, (serializers.BaseSerializer, serializers.ManyRelatedField)):
+                return None
+            if isinstance(field, serializers.RelatedField) and (
+                not isinstance(field, serializers.PrimaryKeyRelatedField) or field.pk_field is not None
+            ):
+                return None
+            try:
+                model_field = model._meta.get_field(field.source)
+            except FieldDoesNotExist:
+                return None
+            if not model_field.concrete or model_field.many_to_many:
+                return None
+            fields.append((field.field_name, field.source, cls.converter(field)))
+            columns.append(field.source)
+            columns.extend(getattr(model, 'FIELD_DEPENDENCIES', {}).get(field.source, ()))
+        return cls(serializer, fields, list(dict.fromkeys(columns)))
+
+    @classmethod
+    def converter(cls, field):
+        if isinstance(field, serializers.JSONField):
+            return field.to_representation if field.binary else None
+        if isinstance(field, cls.PASSTHROUGH_FIELDS):
+            return None
+        if isinstance(field, serializers.DecimalField):
+            return cls.decimal_converter(field)
+        if isinstance(field, serializers.DateTimeField):
+            return cls.datetime_converter(field)
+        if isinstance(field, serializers.DateField) and getattr(field, 'format', api_settings.DATE_FORMAT) == ISO_8601:
+            return lambda value: value.isoformat()
+        return field.to_representation
+
+    @staticmethod
+    def decimal_converter(field):
+        coerce_to_string = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+        if not coerce_to_string or field.localize or field.normalize_output or field.decimal_places is None:
+            return field.to_representation
+        exponent = -field.decimal_places
+
+        def convert(value):
+            # values already stored with the field's scale need no quantizing
+            if value.as_tuple().exponent == exponent:
+                return format(value, 'f')
+            return field.to_representation(value)
+
+        return convert
+
+    @staticmethod
+    def datetime_converter(field):
+        output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+        field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+        if output_format is None or output_format.lower() != ISO_8601 or field_timezone is None:
+            return field.to_representation
+
+        def convert(value):
+            value = value.astimezone(field_timezone).isoformat()
+            return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+        return convert
+
+    def values(self, queryset: QuerySet) -> QuerySet:
+        return queryset.values(*self.columns)
+
+    def to_representation(self, rows) -> list:
+        if isinstance(rows, QuerySet):
+            rows = self.values(rows)
+        rows = list(rows)
+        data = []
+        for row in rows:
+            representation = {}
+            for name, column, convert in self.fields:
+                value = row[column]
+                representation[name] = value if convert is None or value is None else convert(value)
+            data.append(representation)
+        represent_values = getattr(self.serializer, 'represent_values', None)
+        if represent_values is not None:
+            represent_values(rows, data)
+        return data
+
+    @property
+    def data(self) -> list:
+        return serializers.ReturnList(self.to_representation(self.instance), serializer=self)
@@ -13,6 +13,8 @@ from rest_framework.generics import (
 )
 from rest_framework.response import Response
 
+from core.base.serializers import CompiledListSerializer
+
 
 class UnifiedResponseMixin:
     """
@@ -36,6 +38,34 @@ class UnifiedResponseMixin:
         return response
 
 
+class CompiledListMixin:
+    """
+    Serializes list pages with ``CompiledListSerializer`` from ``values()`` rows instead of model
+    instances, when the view's serializer compiles. Requests with ``?expand=`` keep the regular path.
+    """
+
+    def get_compiled_list_serializer(self):
+        if not hasattr(self, '_compiled_list_serializer'):
+            compiled = None
+            if self.request.method == 'GET' and not self.request.query_params.get('expand'):
+                compiled = CompiledListSerializer.compile(self.get_serializer())
+            self._compiled_list_serializer = compiled
+        return self._compiled_list_serializer
+
+    def paginate_queryset(self, queryset):
+        compiled = self.get_compiled_list_serializer()
+        if compiled is not None:
+            queryset = compiled.values(queryset)
+        return super().paginate_queryset(queryset)
+
+    def get_serializer(self, *args, **kwargs):
+        compiled = self.get_compiled_list_serializer() if kwargs.get('many') and args else None
+        if compiled is None:
+            return super().get_serializer(*args, **kwargs)
+        compiled.instance = args[0]
+        return compiled
+
+
 class UnifiedResponseListAPIView(UnifiedResponseMixin, ListAPIView):
     list_success_message = 'Data retrieved successfully'
     list_error_message = 'Failed to retrieve data'
@@ -0,0 +1,23 @@
+from django.db import connections
+
+from core.routers import ReadYourWrites
+
+
+class ReadYourWritesMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = ReadYourWrites.start(request)
+        state = ReadYourWrites.current()
+        try:
+            with connections['default'].execute_wrapper(state.record_writes):
+                response = self.get_response(request)
+            state.finish(response)
+        finally:
+            ReadYourWrites.end(token)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+        ReadYourWrites.current().staleness_budget = getattr(view_class, 'replica_staleness_budget', None)
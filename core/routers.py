@@ -1,5 +1,194 @@
+import logging
+import time
+from contextvars import ContextVar
+
+import psycopg
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.utils.functional import SimpleLazyObject
+
+db_logger = logging.getLogger("db")
+
+
+class ReadYourWrites:
+    """
+    Request state deciding whether reads may go to the replica. Reads stick to ``default`` for
+    ``READ_YOUR_WRITES_WINDOW`` seconds after a write, for the rest of the writing request and for
+    follow-up requests carrying the pin cookie or coming from a user with a pin key in the cache.
+    """
+
+    _current = ContextVar('read_your_writes', default=None)
+    WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'MERGE')
+
+    def __init__(self, request):
+        self.request = request
+        self.wrote = False
+        self.pinned = self.cookie_pinned(request)
+        self.user_checked = False
+        self.staleness_budget = None
+
+    @classmethod
+    def current(cls):
+        return cls._current.get()
+
+    @classmethod
+    def start(cls, request):
+        return cls._current.set(cls(request))
+
+    @classmethod
+    def end(cls, token) -> None:
+        cls._current.reset(token)
+
+    @staticmethod
+    def user_key(user_id) -> str:
+        return f"rw-pin:{user_id}"
+
+    @staticmethod
+    def cookie_pinned(request) -> bool:
+        try:
+            pinned_until = float(request.COOKIES.get(settings.READ_YOUR_WRITES_COOKIE, 0))
+        except ValueError:
+            return False
+        now = time.time()
+        # a forged far-future value never pins for longer than one window
+        return now < pinned_until <= now + settings.READ_YOUR_WRITES_WINDOW
+
+    def user_id(self):
+        # only a user already resolved by authentication, loading the session user here would query
+        user = self.request.__dict__.get('user')
+        if user is None or isinstance(user, SimpleLazyObject) or not user.is_authenticated:
+            return None
+        return user.pk
+
+    def reads_from_primary(self) -> bool:
+        if self.wrote or self.pinned:
+            return True
+        if not self.user_checked:
+            user_id = self.user_id()
+            if user_id is not None:
+                self.user_checked = True
+                self.pinned = bool(cache.get(self.user_key(user_id)))
+        return self.pinned
+
+    def record_writes(self, execute, sql, params, many, context):
+        """
+        ``execute_wrapper`` of the ``default`` connection, the request wrote once a statement changed
+        rows there. Reads sent to ``default`` through ``db_for_write`` and guarded updates that
+        matched nothing don't pin.
+        """
+        result = execute(sql, params, many, context)
+        if not self.wrote and context['cursor'].rowcount > 0:
+            self.wrote = sql.lstrip().split(None, 1)[0].upper() in self.WRITE_STATEMENTS
+        return result
+
+    def finish(self, response) -> None:
+        """
+        Pin the client's next reads to ``default`` when this request wrote.
+        """
+        window = settings.READ_YOUR_WRITES_WINDOW
+        if not self.wrote or not window:
+            return
+        response.set_cookie(
+            settings.READ_YOUR_WRITES_COOKIE,
+            str(int(time.time() + window)),
+            max_age=window,
+            httponly=True,
+            samesite='Lax',
+        )
+        user_id = self.user_id()
+        if user_id is not None:
+            cache.set(self.user_key(user_id), 1, timeout=window)
+
+
+class ReplicaHealth:
+    """
+    Replica lag sampled by the ``probe_replica_lag`` task and shared through the cache. Each process
+    keeps its own copy for ``REPLICA_HEALTH_LOCAL_TTL`` seconds so routing a read never waits on Redis.
+
+    The circuit is open, and reads fall back to ``default``, while the last ``REPLICA_FAILURE_THRESHOLD``
+    probes failed or no probe reported within ``REPLICA_HEALTH_TTL`` seconds. It closes on the next
+    successful probe.
+    """
+
+    CACHE_KEY = 'replica-health'
+    ALIAS = 'replica'
+    LAG_SQL = """
+        SELECT CASE
+            WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+        END
+    """
+
+    _local = None
+
+    @classmethod
+    def state(cls) -> dict:
+        local = cls._local
+        if local is None or local[0] < time.monotonic():
+            local = (time.monotonic() + settings.REPLICA_HEALTH_LOCAL_TTL, cache.get(cls.CACHE_KEY))
+            cls._local = local
+        return local[1]
+
+    @classmethod
+    def record(cls, lag: float = None) -> dict:
+        """
+        Store the outcome of a probe, ``None`` lag for a failed one.
+        """
+        previous = cache.get(cls.CACHE_KEY) or {}
+        state = {
+            'lag': previous.get('lag') if lag is None else lag,
+            'failures': previous.get('failures', 0) + 1 if lag is None else 0,
+            'checked_at': time.time(),
+        }
+        cache.set(cls.CACHE_KEY, state, timeout=settings.REPLICA_HEALTH_TTL)
+        cls._local = None
+        return state
+
+    @classmethod
+    def probe(cls) -> dict:
+        """
+        Measure the replica lag in seconds over a dedicated connection, the pool would make an
+        unreachable replica block the probe for its whole checkout timeout.
+        """
+        params = connections[cls.ALIAS].get_connection_params()
+        params['connect_timeout'] = settings.REPLICA_PROBE_TIMEOUT
+        params['options'] = f"-c statement_timeout={settings.REPLICA_PROBE_TIMEOUT * 1000}"
+        try:
+            with psycopg.connect(**params) as connection:
+                lag = float(connection.execute(cls.LAG_SQL).fetchone()[0])
+        except psycopg.Error as e:
+            db_logger.warning("Replica probe failed: %s", e)
+            lag = None
+        return cls.record(lag)
+
+    @classmethod
+    def within(cls, budget: float) -> bool:
+        state = cls.state()
+        if state is None or state['lag'] is None or state['failures'] >= settings.REPLICA_FAILURE_THRESHOLD:
+            return False
+        return state['lag'] <= budget
+
+    @staticmethod
+    def budget(model, view_budget: float = None) -> float:
+        """
+        Staleness in seconds ``model`` reads accept, the tighter of the model's entry in
+        ``REPLICA_STALENESS_BUDGETS`` and the view's ``replica_staleness_budget``.
+        """
+        budget = settings.REPLICA_STALENESS_BUDGETS.get(model._meta.label_lower, settings.REPLICA_MAX_LAG)
+        return budget if view_budget is None else min(budget, view_budget)
+
+
 class DBRouter:
     def db_for_read(self, model, **hints):
+        # reads inside a transaction on the primary must see its own uncommitted writes
+        if connections['default'].in_atomic_block:
+            return 'default'
+        state = ReadYourWrites.current()
+        if state is not None and state.reads_from_primary():
+            return 'default'
+        if not ReplicaHealth.within(ReplicaHealth.budget(model, state and state.staleness_budget)):
+            return 'default'
         return 'replica'
 
     def db_for_write(self, model, **hints):
@@ -50,6 +50,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middlewares.ReadYourWritesMiddleware.ReadYourWritesMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -176,8 +177,14 @@ REST_FRAMEWORK = {
     #     'anon': '100/day',
     #     'burst': '10/minute',
     # },
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.base.renderers.FastJSONRenderer',
+        'core.base.renderers.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_PARSER_CLASSES': [
-        'rest_framework.parsers.JSONParser',
+        'core.base.parsers.FastJSONParser',
+        'core.base.parsers.MessagePackParser',
         'rest_framework.parsers.FormParser',
         'rest_framework.parsers.MultiPartParser',
     ],
@@ -211,6 +218,40 @@ SPECTACULAR_SETTINGS = {
 #     }
 # }
 
+IDEMPOTENCY_KEY_TTL = env_config('IDEMPOTENCY_KEY_TTL', cast=int, default=60 * 60 * 24)
+IDEMPOTENCY_LOCK_TTL = env_config('IDEMPOTENCY_LOCK_TTL', cast=int, default=60)
+TIER_LIMITS_CACHE_TTL = env_config('TIER_LIMITS_CACHE_TTL', cast=int, default=60 * 60 * 24)
+TIER_LIMITS_LOCAL_TTL = env_config('TIER_LIMITS_LOCAL_TTL', cast=int, default=60)
+TRANSFER_EXPIRY_BATCH_SIZE = env_config('TRANSFER_EXPIRY_BATCH_SIZE', cast=int, default=500)
+BANK_WEBHOOK_ASYNC = env_config('BANK_WEBHOOK_ASYNC', cast=bool, default=False)
+BANK_EVENTS_BATCH_SIZE = env_config('BANK_EVENTS_BATCH_SIZE', cast=int, default=200)
+BANK_WEBHOOK_MAX_EVENTS = env_config('BANK_WEBHOOK_MAX_EVENTS', cast=int, default=10000)
+NOTIFICATION_OUTBOX_BATCH_SIZE = env_config('NOTIFICATION_OUTBOX_BATCH_SIZE', cast=int, default=500)
+NOTIFICATION_OUTBOX_REDELIVER_AFTER = env_config('NOTIFICATION_OUTBOX_REDELIVER_AFTER', cast=int, default=10 * 60)
+TRANSACTION_EXPORT_CHUNK_SIZE = env_config('TRANSACTION_EXPORT_CHUNK_SIZE', cast=int, default=2000)
+QUERY_PLAN_CACHE_SIZE = env_config('QUERY_PLAN_CACHE_SIZE', cast=int, default=1024)
+READ_YOUR_WRITES_WINDOW = env_config('READ_YOUR_WRITES_WINDOW', cast=int, default=5)
+READ_YOUR_WRITES_COOKIE = env_config('READ_YOUR_WRITES_COOKIE', default='pin_primary_until')
+REPLICA_PROBE_INTERVAL = env_config('REPLICA_PROBE_INTERVAL', cast=int, default=5)
+REPLICA_PROBE_TIMEOUT = env_config('REPLICA_PROBE_TIMEOUT', cast=int, default=2)
+REPLICA_HEALTH_TTL = env_config('REPLICA_HEALTH_TTL', cast=int, default=30)
+REPLICA_HEALTH_LOCAL_TTL = env_config('REPLICA_HEALTH_LOCAL_TTL', cast=float, default=1.0)
+REPLICA_FAILURE_THRESHOLD = env_config('REPLICA_FAILURE_THRESHOLD', cast=int, default=2)
+REPLICA_MAX_LAG = env_config('REPLICA_MAX_LAG', cast=float, default=10.0)
+# seconds of replica lag reads of a model tolerate, models not listed use REPLICA_MAX_LAG
+REPLICA_STALENESS_BUDGETS = {
+    'wallets.wallet': 1.0,
+}
+
+SMS_PROVIDER = env_config('SMS_PROVIDER', default='utils.sms.FakeSmsProvider')
+SMS_PROVIDER_URL = env_config('SMS_PROVIDER_URL', default='')
+SMS_PROVIDER_TOKEN = env_config('SMS_PROVIDER_TOKEN', default='')
+SMS_PROVIDER_TIMEOUT = env_config('SMS_PROVIDER_TIMEOUT', cast=float, default=5)
+SMS_PROVIDER_RATE_LIMIT = env_config('SMS_PROVIDER_RATE_LIMIT', cast=float, default=50)
+SMS_PROVIDER_POOL_SIZE = env_config('SMS_PROVIDER_POOL_SIZE', cast=int, default=10)
+SMS_MAX_RETRIES = env_config('SMS_MAX_RETRIES', cast=int, default=5)
+SMS_RETRY_DELAY = env_config('SMS_RETRY_DELAY', cast=int, default=30)
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.0/topics/i18n/
 
@@ -234,6 +275,7 @@ CORS_ALLOW_HEADERS = (
     'x-requested-with',
     'x-api-key',
     'content-disposition',
+    'idempotency-key',
 )
 CORS_ALLOW_METHODS = [
     'GET',
@@ -286,3 +328,31 @@ CELERY_CACHE_BACKEND = env_config('CELERY_BROKER_URL', default='redis://localhos
 CELERY_TASK_TRACK_STARTED = env_config('CELERY_TASK_TRACK_STARTED', cast=bool, default=True)
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = env_config('CELERY_TASK_TRACK_STARTED', cast=bool, default=True)
 CELERY_BROKER_CONNECTION_MAX_RETRIES = env_config('CELERY_BROKER_CONNECTION_MAX_RETRIES', cast=int, default=3)
+
+CELERY_BEAT_SCHEDULE = {
+    'compact-wallet-shards': {
+        'task': 'wallets.tasks.compact_wallet_shards',
+        'schedule': timedelta(minutes=1),
+    },
+    'checkpoint-wallet-balances': {
+        'task': 'wallets.tasks.checkpoint_wallet_balances',
+        'schedule': timedelta(minutes=10),
+    },
+    'expire-pending-transfers': {
+        'task': 'wallets.tasks.expire_pending_transfers',
+        'schedule': timedelta(minutes=1),
+    },
+    'process-bank-events': {
+        'task': 'wallets.tasks.process_bank_events',
+        'schedule': timedelta(minutes=1),
+    },
+    'relay-notification-outbox': {
+        'task': 'wallets.tasks.relay_notification_outbox',
+        'schedule': timedelta(minutes=1),
+    },
+    'probe-replica-lag': {
+        'task': 'utils.common_tasks.probe_replica_lag',
+        'schedule': timedelta(seconds=REPLICA_PROBE_INTERVAL),
+        'options': {'expires': REPLICA_PROBE_INTERVAL},
+    },
+}
@@ -0,0 +1,19 @@
+import io
+
+import pytest
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+
+from core.base.parsers import FastJSONParser
+
+
+def test_fast_json_parser_matches_stdlib_parser():
+    body = '{"amount": 12.5, "name": "Café", "ids": [1, 2], "big": 1180591620717411303424}'.encode()
+    assert FastJSONParser().parse(io.BytesIO(body)) == JSONParser().parse(io.BytesIO(body))
+
+    for invalid in (b'{"amount": NaN}', b'{"amount": '):
+        with pytest.raises(ParseError) as fast_error:
+            FastJSONParser().parse(io.BytesIO(invalid))
+        with pytest.raises(ParseError) as stdlib_error:
+            JSONParser().parse(io.BytesIO(invalid))
+        assert str(fast_error.value) == str(stdlib_error.value)
@@ -0,0 +1,38 @@
+import uuid
+from datetime import date, datetime
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+from zoneinfo import ZoneInfo
+
+import pytest
+from django.utils.translation import gettext_lazy
+from rest_framework.renderers import JSONRenderer
+
+from core.base.renderers import FastJSONRenderer
+
+
+def test_fast_json_renderer_matches_stdlib_output():
+    data = {
+        'amount': Decimal("1250.50"),
+        'created_at': datetime(2025, 5, 1, 10, 30, 15, 123456, tzinfo=dt_timezone.utc),
+        'expires_at': datetime(2025, 5, 1, 12, 0, tzinfo=ZoneInfo('Africa/Cairo')),
+        'day': date(2025, 5, 1),
+        'reference': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+        'message': gettext_lazy('Insufficient balance'),
+        'description': "Café \u2028 rent \u2029 €",
+        'limits': {1: [True, None, 3, 0.5]},
+    }
+    assert FastJSONRenderer().render(data) == JSONRenderer().render(data)
+    # orjson rejects integers beyond 64 bits, the stdlib renders them
+    assert FastJSONRenderer().render({'id': 2**70}) == JSONRenderer().render({'id': 2**70})
+    assert FastJSONRenderer().render(data, 'application/json; indent=2') == JSONRenderer().render(
+        data, 'application/json; indent=2'
+    )
+    # non-finite floats, which orjson would write as null, are refused like the strict stdlib renderer does
+    for data in ({'rate': float('nan')}, {'limits': [None, {'cap': float('-inf')}]}):
+        with pytest.raises(ValueError) as fast_error:
+            FastJSONRenderer().render(data)
+        with pytest.raises(ValueError) as stdlib_error:
+            JSONRenderer().render(data)
+        assert str(fast_error.value) == str(stdlib_error.value)
+    assert FastJSONRenderer().render({'rate': None, 'cap': 1.5}) == b'{"rate":null,"cap":1.5}'
@@ -0,0 +1,56 @@
+from decimal import Decimal
+
+import psycopg
+import pytest
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from core.middlewares.ReadYourWritesMiddleware import ReadYourWritesMiddleware
+from core.routers import DBRouter, ReplicaHealth
+from wallets.ledger import InsufficientBalance, WalletLedger
+from wallets.models import Transaction, Wallet
+
+
+@pytest.mark.django_db(databases=['default', 'replica'], transaction=True)
+def test_only_statements_changing_rows_pin_reads_to_the_primary(rf, user_a_primary_usd_wallet):
+    wallet = Wallet.objects.get(pk=user_a_primary_usd_wallet.pk)
+
+    def rejected_debit(request):
+        with pytest.raises(InsufficientBalance):
+            WalletLedger.debit(wallet, Decimal("10000.00"), 'withdrawn_today', Decimal("100000.00"))
+        return HttpResponse()
+
+    def debit(request):
+        WalletLedger.debit(wallet, Decimal("10.00"), 'withdrawn_today', Decimal("100000.00"))
+        return HttpResponse()
+
+    assert settings.READ_YOUR_WRITES_COOKIE not in ReadYourWritesMiddleware(rejected_debit)(rf.get('/')).cookies
+    assert settings.READ_YOUR_WRITES_COOKIE in ReadYourWritesMiddleware(debit)(rf.get('/')).cookies
+
+
+@pytest.mark.django_db(databases=['default', 'replica'], transaction=True)
+def test_reads_follow_replica_lag_and_fall_back_to_primary(mocker):
+    router = DBRouter()
+    cache.delete(ReplicaHealth.CACHE_KEY)
+    ReplicaHealth._local = None
+    assert router.db_for_read(Wallet) == 'default'
+
+    assert ReplicaHealth.probe()['lag'] == 0
+    assert router.db_for_read(Wallet) == 'replica'
+
+    # within the default budget of transactions, over the one of wallets
+    ReplicaHealth.record(lag=5.0)
+    assert router.db_for_read(Wallet) == 'default'
+    assert router.db_for_read(Transaction) == 'replica'
+
+    connect = mocker.patch('core.routers.psycopg.connect', side_effect=psycopg.OperationalError("timeout"))
+    ReplicaHealth.probe()
+    assert router.db_for_read(Transaction) == 'replica'
+    ReplicaHealth.probe()
+    assert router.db_for_read(Transaction) == 'default'
+
+    connect.side_effect = None
+    connect.return_value.__enter__.return_value.execute.return_value.fetchone.return_value = (0.2,)
+    ReplicaHealth.probe()
+    assert router.db_for_read(Transaction) == 'replica'
@@ -1,6 +1,9 @@
 from celery import shared_task
 from django.core.mail import EmailMultiAlternatives
 
+from core.routers import ReplicaHealth
+from utils.sms import get_sms_provider
+
 
 @shared_task
 def send_email_task(email, subject, body="", html=None):
@@ -21,7 +24,7 @@ def send_email_task(email, subject, body="", html=None):
     return f"Email sent to {email} with subject '{subject}'"
 
 
-@shared_task
+@shared_task(ignore_result=True)
 def send_sms_task(phone_number, message):
     """
     Task to send an SMS asynchronously.
@@ -29,6 +32,12 @@ def send_sms_task(phone_number, message):
     :param phone_number: Recipient's phone number
     :param message: Message to be sent
     """
-    # using Twilio or any other SMS service would be implemented here
-    print(f"Sending SMS to {phone_number}: {message}")
-    return f"SMS sent to {phone_number}: {message}"
+    get_sms_provider().send(phone_number, message)
+
+
+@shared_task(ignore_result=True)
+def probe_replica_lag():
+    """
+    Task to sample the replica lag that read routing checks against staleness budgets.
+    """
+    ReplicaHealth.probe()
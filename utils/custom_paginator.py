@@ -1,4 +1,6 @@
-from rest_framework.pagination import PageNumberPagination
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class CustomPaginator(PageNumberPagination):
@@ -8,7 +10,50 @@ class CustomPaginator(PageNumberPagination):
     def paginate_queryset(self, queryset, request, view=None):
         self.page_size = self.get_page_size(request)
         if request.GET.get('page') == '*':
-            self.page_size = len(queryset) if len(queryset) > 0 else 1
+            self.page_size = queryset.count() or 1
             request.GET._mutable = True
             request.GET['page'] = 1
         return super().paginate_queryset(queryset, request, view)
+
+
+class CustomCursorPaginator(CursorPagination):
+    """
+    Keyset paginator, pages are reached through opaque next/previous cursors and never counted.
+
+    Cursors position on the first ordering field and skip rows sharing its value by an offset DRF
+    caps, so ``?ordering=`` is limited to the unique or nearly unique ``cursor_ordering_fields``
+    and ``id`` breaks the ties, pages neither skip nor repeat rows.
+    """
+
+    ordering = '-id'
+    cursor_ordering_fields = ('id', 'created_at')
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if ordering[0].lstrip('-') not in self.cursor_ordering_fields:
+            raise ValidationError(
+                {
+                    'ordering': _("Cursor pagination can only be ordered by: %s.")
+                    % ', '.join(self.cursor_ordering_fields)
+                }
+            )
+        if 'id' not in {field.lstrip('-') for field in ordering}:
+            ordering = (*ordering, '-id' if ordering[0].startswith('-') else 'id')
+        return ordering
+
+
+class OptInCursorPaginationMixin:
+    """
+    Paginates a list view with ``cursor_pagination_class`` when the request asks for
+    ``?pagination=cursor``, with the view's usual paginator otherwise.
+    """
+
+    cursor_pagination_class = CustomCursorPaginator
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator') and self.request.query_params.get('pagination') == 'cursor':
+            self._paginator = self.cursor_pagination_class()
+        return super().paginator
@@ -0,0 +1,36 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from core.base.renderers import dumps
+
+
+class _Echo:
+    """File-like object handing every written line straight back to the csv writer's caller"""
+
+    def write(self, value):
+        return value
+
+
+def stream_ndjson(rows):
+    """Yield every row dict as one compact JSON line, encoded with orjson when it's installed"""
+    encoder = DjangoJSONEncoder(separators=(',', ':'), ensure_ascii=False)
+    for row in rows:
+        try:
+            yield dumps(row, encoder.default) + b'\n'
+        except ValueError:
+            yield (encoder.encode(row) + '\n').encode()
+
+
+def stream_csv(rows, fields):
+    """Yield a header line for ``fields`` then one CSV line per row dict, nested values are written as JSON"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow(
+            [
+                json.dumps(row[field], cls=DjangoJSONEncoder) if isinstance(row[field], (dict, list)) else row[field]
+                for field in fields
+            ]
+        )
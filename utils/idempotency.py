@@ -0,0 +1,85 @@
+import functools
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework import status
+from rest_framework.response import Response
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+def _cache_key(request, key):
+    scope = request.user.pk if getattr(request.user, 'is_authenticated', False) else 'anonymous'
+    digest = hashlib.sha256(f"{scope}:{request.path}:{key}".encode()).hexdigest()
+    return f"idempotency:{digest}"
+
+
+def _fingerprint(request):
+    return hashlib.sha256(json.dumps(request.data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _stored_response(entry, fingerprint):
+    if entry['fingerprint'] != fingerprint:
+        return Response(
+            {
+                'success': False,
+                'message': _("Idempotency-Key has already been used with a different request body."),
+                'data': None,
+            },
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    if entry.get('in_flight'):
+        return Response(
+            {'success': False, 'message': _("A request with this Idempotency-Key is still in progress."), 'data': None},
+            status=status.HTTP_409_CONFLICT,
+        )
+    return Response(entry['data'], status=entry['status'], headers={REPLAYED_HEADER: 'true'})
+
+
+def idempotent(view_method):
+    """
+    Run a view method at most once per ``Idempotency-Key`` header. The first response is kept in the
+    cache for ``IDEMPOTENCY_KEY_TTL`` seconds and replayed for retries of the same request, a retry
+    that arrives while the first one is still running gets a 409 instead of running it twice.
+    Requests without the header are handled as usual.
+    """
+
+    @functools.wraps(view_method)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view_method(view, request, *args, **kwargs)
+
+        cache_key = _cache_key(request, key)
+        fingerprint = _fingerprint(request)
+        entry = cache.get(cache_key)
+        if entry is not None:
+            return _stored_response(entry, fingerprint)
+        if not cache.add(
+            cache_key, {'fingerprint': fingerprint, 'in_flight': True}, timeout=settings.IDEMPOTENCY_LOCK_TTL
+        ):
+            # another worker claimed the key between our get and add
+            entry = cache.get(cache_key) or {'fingerprint': fingerprint, 'in_flight': True}
+            return _stored_response(entry, fingerprint)
+
+        try:
+            response = view_method(view, request, *args, **kwargs)
+        except Exception:
+            cache.delete(cache_key)
+            raise
+
+        if response.status_code >= 500:
+            cache.delete(cache_key)
+        else:
+            cache.set(
+                cache_key,
+                {'fingerprint': fingerprint, 'status': response.status_code, 'data': response.data},
+                timeout=settings.IDEMPOTENCY_KEY_TTL,
+            )
+        return response
+
+    return wrapper
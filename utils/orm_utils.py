@@ -1,88 +1,192 @@
+import logging
+from functools import lru_cache
+
+from django.conf import settings
 from django.core.exceptions import FieldDoesNotExist
-from django.db.models import Model, QuerySet
-from django.db.models.fields.reverse_related import (
-    ForeignObjectRel,
-    ManyToManyRel,
-    ManyToOneRel,
-    OneToOneRel,
-)
+from django.db.models import Model, Prefetch, QuerySet
+from django.db.models.fields.reverse_related import ForeignObjectRel
 from rest_framework.request import Request
 
+orm_logger = logging.getLogger("orm")
+
+
+def path_tree(paths: str) -> dict:
+    """
+    Turn ``id,user.tier`` into ``{'id': {}, 'user': {'tier': {}}}``.
+    """
+    tree = {}
+    for path in (paths or '').split(','):
+        node = tree
+        for part in filter(None, path.strip().split('.')):
+            node = node.setdefault(part, {})
+    return tree
+
 
-def is_path_contains_reverse_relation(model: Model, path: str) -> bool:
-    current_model = model
-    parts = path.split(".")
+def is_many(field_obj) -> bool:
+    """
+    Whether following ``field_obj`` can lead to several rows, those relations are prefetched instead of joined.
+    """
+    return isinstance(field_obj, ForeignObjectRel) and not field_obj.one_to_one or field_obj.many_to_many
 
-    for part in parts:
+
+def invalid_field_paths(model: Model, fields: dict, prefix: str = '') -> list:
+    """
+    Dotted paths of a ``?fields=`` tree of ``model`` that name no field, or go past a field that isn't a relation.
+    """
+    paths = []
+    for name, subtree in fields.items():
         try:
-            field_obj = current_model._meta.get_field(part)
-            if isinstance(field_obj, (ManyToManyRel, ForeignObjectRel, ManyToOneRel, OneToOneRel)):
-                return True
-            if hasattr(field_obj, 'related_model'):
-                current_model = field_obj.related_model
-            else:
-                raise FieldDoesNotExist(f"Field '{part}' is not a valid relationship field.")
+            field_obj = model._meta.get_field(name)
         except FieldDoesNotExist:
-            raise FieldDoesNotExist(f"Field '{part}' is not a valid relationship field.")
+            paths.append(f"{prefix}{name}")
+            continue
+        if not subtree:
+            continue
+        if field_obj.is_relation:
+            paths.extend(invalid_field_paths(field_obj.related_model, subtree, f"{prefix}{name}."))
+        else:
+            paths.extend(f"{prefix}{name}.{child}" for child in subtree)
+    return paths
 
-    return False
 
+class ExpansionPlan:
+    """
+    Queryset plan for an ``?expand=`` tree and a ``?fields=`` tree of ``model``.
 
-def query_optimizer(model: Model, request: Request) -> QuerySet:
-    expand = request.query_params.get('expand', None)
-    fields = request.query_params.get('fields', None)
-    queryset = model.objects.all()
+    Forward relations are joined with ``select_related``, reverse and many relations are prefetched
+    with a ``Prefetch`` whose queryset is planned the same way for the subtrees, so an expanded page
+    costs one query per prefetched relation whatever its size. When fields are picked, ``only()``
+    loads them, the columns listed in their model's ``FIELD_DEPENDENCIES`` and whatever the
+    expansions need, every column of expanded rows none of whose fields were picked.
+    """
+
+    def __init__(self, model: Model, expand: dict, fields: dict = None, parent_field=None):
+        self.model = model
+        self.expand = expand or {}
+        self.fields = fields or {}
+        self.invalid = []
+        self.select_related = []
+        self.prefetches = []
+        self._plan_relations(model, self.expand, self.fields, '')
+
+        self.only = []
+        if self._picks_columns(model, self.fields):
+            self.only = self._plan_columns(model, self.fields, self.expand, '')
+            if parent_field is not None:
+                # the prefetch matches rows back to their parents through this column
+                self.only.append(parent_field.field.name)
+
+    def _relation(self, model: Model, name: str, path: str):
+        try:
+            field_obj = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            field_obj = None
+        if field_obj is None or not field_obj.is_relation:
+            self.invalid.append(path)
+            return None
+        return field_obj
+
+    def _plan_relations(self, model: Model, expand: dict, fields: dict, prefix: str):
+        for name, subtree in expand.items():
+            field_obj = self._relation(model, name, f"{prefix}{name}".replace('__', '.'))
+            if field_obj is None:
+                continue
+            nested_fields = fields.get(name) or {}
+            if is_many(field_obj):
+                plan = ExpansionPlan(
+                    field_obj.related_model,
+                    subtree,
+                    nested_fields,
+                    parent_field=field_obj if field_obj.one_to_many else None,
+                )
+                self.invalid.extend(f"{prefix}{name}.{path}" for path in plan.invalid)
+                self.prefetches.append((f"{prefix}{name}", field_obj.related_model, plan))
+            else:
+                self.select_related.append(f"{prefix}{name}")
+                self._plan_relations(field_obj.related_model, subtree, nested_fields, f"{prefix}{name}__")
 
-    if expand:
-        expand_fields = expand.split(',')
-        select_related = set()
-        prefetch_related = set()
+    def _picks_columns(self, model: Model, fields: dict) -> bool:
+        for name in fields:
+            try:
+                field_obj = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            if not is_many(field_obj):
+                return True
+        return False
 
-        for field in expand_fields:
+    def _plan_columns(self, model: Model, fields: dict, expand: dict, prefix: str) -> list:
+        columns = []
+        for name, subtree in fields.items():
             try:
-                is_reverse_or_many = is_path_contains_reverse_relation(model, field)
-                if is_reverse_or_many:
-                    prefetch_related.add(field.replace('.', '__'))
-                else:
-                    select_related.add(field.replace('.', '__'))
-            except FieldDoesNotExist as e:
-                print(f"Skipping invalid field: {str(e)}")
+                field_obj = model._meta.get_field(name)
+            except FieldDoesNotExist:
                 continue
+            if is_many(field_obj):
+                # picked on the prefetched queryset, see _plan_relations
+                continue
+            columns.append(f"{prefix}{name}")
+            columns.extend(f"{prefix}{column}" for column in getattr(model, 'FIELD_DEPENDENCIES', {}).get(name, ()))
+            if subtree and field_obj.is_relation:
+                columns.extend(
+                    self._plan_columns(field_obj.related_model, subtree, expand.get(name, {}), f"{prefix}{name}__")
+                )
 
-        if select_related:
-            queryset = queryset.select_related(*select_related)
-        if prefetch_related:
-            queryset = queryset.prefetch_related(*prefetch_related)
-
-    if fields:
-        valid_fields = []
-        field_list = fields.split(',')
-
-        for field in field_list:
-            field_parts = field.split('.')
-            current_model = model
-            is_valid = True
-
-            for part in field_parts[:-1]:
-                try:
-                    field_obj = current_model._meta.get_field(part)
-                    if hasattr(field_obj, 'related_model'):
-                        current_model = field_obj.related_model
-                    else:
-                        is_valid = False
-                        break
-                except FieldDoesNotExist:
-                    is_valid = False
-                    break
-
-            if is_valid:
-                try:
-                    current_model._meta.get_field(field_parts[-1])
-                    valid_fields.append(field.replace('.', '__'))
-                except FieldDoesNotExist:
-                    pass
-
-        if valid_fields:
-            queryset = queryset.only(*valid_fields)
-
-    return queryset
+        for name, subtree in expand.items():
+            try:
+                field_obj = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            if not field_obj.is_relation or is_many(field_obj):
+                continue
+            if self._picks_columns(field_obj.related_model, fields.get(name) or {}):
+                # its picked columns and deeper expansions were planned with the fields above
+                continue
+            columns.append(f"{prefix}{name}")
+            related_model = field_obj.related_model
+            columns.extend(f"{prefix}{name}__{field.name}" for field in related_model._meta.concrete_fields)
+            columns.extend(self._plan_columns(related_model, {}, subtree, f"{prefix}{name}__"))
+        return columns
+
+    def apply(self, queryset: QuerySet) -> QuerySet:
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.prefetches:
+            # Prefetch querysets are built per call, plans are shared between requests
+            queryset = queryset.prefetch_related(
+                *(
+                    Prefetch(lookup, queryset=related_plan.apply(related_model.objects.all()))
+                    for lookup, related_model, related_plan in self.prefetches
+                )
+            )
+        if self.only:
+            queryset = queryset.only(*self.only)
+        return queryset
+
+
+@lru_cache(maxsize=settings.QUERY_PLAN_CACHE_SIZE)
+def compile_plan(model: Model, expand: str, fields: str) -> ExpansionPlan:
+    """
+    ``ExpansionPlan`` for raw ``?expand=``/``?fields=`` values. Clients repeat a handful of query
+    strings, so plans are kept in a bounded LRU and invalid paths are logged once per plan.
+    """
+    plan = ExpansionPlan(model, path_tree(expand), path_tree(fields))
+    for param, paths in (('expand', plan.invalid), ('fields', invalid_field_paths(model, plan.fields))):
+        for path in paths:
+            orm_logger.warning(
+                "Skipping invalid %s path '%s' of %s.",
+                param,
+                path,
+                model._meta.label,
+                extra={'model': model._meta.label, 'param': param, 'path': path},
+            )
+    return plan
+
+
+def query_optimizer(model: Model, request: Request) -> QuerySet:
+    """
+    ``model`` queryset following ``?expand=`` and loading only the columns picked with ``?fields=``,
+    see ``ExpansionPlan``.
+    """
+    plan = compile_plan(model, request.query_params.get('expand', ''), request.query_params.get('fields', ''))
+    return plan.apply(model.objects.all())
@@ -0,0 +1,106 @@
+import logging
+import threading
+import time
+from functools import lru_cache
+
+import requests
+from django.conf import settings
+from django.utils.module_loading import import_string
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+sms_logger = logging.getLogger("sms")
+
+
+class RateLimiter:
+    """
+    Token bucket allowing ``rate`` calls per second on average, shared by the threads of a process.
+    """
+
+    def __init__(self, rate: float, burst: int = None):
+        self.rate = rate
+        self.capacity = burst or max(int(rate), 1)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            wait = (1 - self.tokens) / self.rate if self.tokens < 1 else 0
+            self.tokens -= 1
+        if wait:
+            time.sleep(wait)
+
+
+class BaseSmsProvider:
+    def send(self, phone_number: str, message: str) -> None:
+        raise NotImplementedError
+
+    def send_many(self, messages) -> list:
+        """
+        Send ``(phone_number, message)`` pairs and return the ones that couldn't be sent, a failing
+        message is logged and doesn't stop the rest of the batch.
+        """
+        failed = []
+        for phone_number, message in messages:
+            try:
+                self.send(phone_number, message)
+            except Exception as e:
+                sms_logger.error("Sending SMS to %s failed: %s", phone_number, e)
+                failed.append((phone_number, message))
+        return failed
+
+
+class ConsoleSmsProvider(BaseSmsProvider):
+    def send(self, phone_number, message):
+        sms_logger.info("Sending SMS to %s: %s", phone_number, message)
+
+
+class FakeSmsProvider(BaseSmsProvider):
+    """
+    Keeps sent messages in ``FakeSmsProvider.outbox`` instead of delivering them, for tests and local runs.
+    """
+
+    outbox = []
+
+    def send(self, phone_number, message):
+        self.outbox.append((phone_number, message))
+
+
+class HttpSmsProvider(BaseSmsProvider):
+    """
+    Posts every message to ``SMS_PROVIDER_URL`` over a pooled, retrying session, throttled to
+    ``SMS_PROVIDER_RATE_LIMIT`` messages per second per worker process.
+    """
+
+    def __init__(self):
+        self.url = settings.SMS_PROVIDER_URL
+        self.timeout = settings.SMS_PROVIDER_TIMEOUT
+        self.rate_limiter = RateLimiter(settings.SMS_PROVIDER_RATE_LIMIT)
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = f"Bearer {settings.SMS_PROVIDER_TOKEN}"
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=settings.SMS_PROVIDER_POOL_SIZE,
+            max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 503], allowed_methods=['POST']),
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def send(self, phone_number, message):
+        self.rate_limiter.acquire()
+        response = self.session.post(self.url, json={'to': phone_number, 'message': message}, timeout=self.timeout)
+        response.raise_for_status()
+
+
+@lru_cache(maxsize=None)
+def get_sms_provider() -> BaseSmsProvider:
+    """
+    The ``SMS_PROVIDER`` instance of this process, built once so its session and rate limit are reused.
+    """
+    return import_string(settings.SMS_PROVIDER)()
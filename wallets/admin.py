@@ -1,9 +1,25 @@
 from django.contrib import admin
 
-from .models import ATMCode, Tier, TierCurrencyLimit, Transaction, Wallet
+from .models import (
+    ATMCode,
+    BalanceCheckpoint,
+    BankEvent,
+    LedgerEntry,
+    NotificationOutbox,
+    Tier,
+    TierCurrencyLimit,
+    Transaction,
+    Wallet,
+    WalletShard,
+)
 
 admin.site.register(Wallet)
 admin.site.register(Transaction)
 admin.site.register(ATMCode)
 admin.site.register(Tier)
 admin.site.register(TierCurrencyLimit)
+admin.site.register(WalletShard)
+admin.site.register(LedgerEntry)
+admin.site.register(BalanceCheckpoint)
+admin.site.register(BankEvent)
+admin.site.register(NotificationOutbox)
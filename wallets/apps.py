@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class WalletsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'wallets'
+
+    def ready(self):
+        import wallets.signals  # noqa
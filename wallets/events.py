@@ -1,12 +1,22 @@
+import logging
 from abc import ABC, abstractmethod
 from typing import Dict
 
+from django.conf import settings
+from django.db import router
+from django.db.transaction import atomic
 from django.utils import timezone
 
-from .models import ATMCode
-from .serializers import ATMDepositSerializer, ATMWithdrawalSerializer
+from .models import ATMCode, BankEvent, Wallet
+from .serializers import (
+    ATMDepositSerializer,
+    ATMWithdrawalSerializer,
+    BankMoneyEventSerializer,
+)
 from .utils import NotificationOperator, TransactionOperator
 
+events_logger = logging.getLogger("bank_events")
+
 
 class IBankEventHandler(ABC):
     @abstractmethod
@@ -62,10 +72,7 @@ class ATMLoginEventHandler(IBankEventHandler):
         phone_number = event.get("phone_number")
         pass_code = event.get("pass_code")
 
-        if ATMCode.objects.filter(
-            user__phone_number=phone_number, code=pass_code, is_used=False, expires_at__gt=timezone.now()
-        ).exists():
-            ATMCode.objects.filter(user__phone_number=phone_number, code=pass_code).first().mark_as_used()
+        if ATMCode.claim(phone_number, pass_code):
             return {'success': True, 'message': 'Correct Credintials'}
         return {'success': False, 'message': 'Invalid ATM Code'}
 
@@ -83,3 +90,166 @@ class EventsHandler:
         if event_type in self._handlers:
             return self._handlers[event_type].handle_event(event)
         return {'success': False, 'message': 'Invalid Event type'}
+
+
+class BatchEventsHandler:
+    """
+    Handles a list of bank events and returns one result per event, in order. Deposits and
+    withdrawals are applied ``chunk_size`` at a time, each chunk in a single database transaction,
+    other events go through ``EventsHandler`` one by one.
+    """
+
+    MONEY_EVENT_TYPES = ('deposit', 'withdrawal')
+
+    def __init__(self, chunk_size: int):
+        self.chunk_size = chunk_size
+        self.events_handler = EventsHandler()
+
+    def handle_events(self, events: list) -> list:
+        results = [None] * len(events)
+        queued, money = [], []
+        for index, event in enumerate(events):
+            if not isinstance(event, dict):
+                results[index] = {'success': False, 'message': 'Invalid Event type'}
+            elif BankEventInbox.accepts(event):
+                queued.append(index)
+            elif event.get('type') in self.MONEY_EVENT_TYPES:
+                money.append(index)
+            else:
+                results[index] = self.events_handler.handle_event(event)
+
+        for index, bank_event in zip(queued, BankEventInbox.enqueue_many([events[index] for index in queued])):
+            results[index] = {'success': True, 'message': 'Event accepted for processing.', 'event_id': bank_event.id}
+
+        for start in range(0, len(money), self.chunk_size):
+            chunk = money[start : start + self.chunk_size]
+            for index, result in zip(chunk, self._handle_money_events([events[index] for index in chunk])):
+                results[index] = result
+        return results
+
+    @staticmethod
+    def _handle_money_events(events: list) -> list:
+        results = [None] * len(events)
+        serializers = [BankMoneyEventSerializer(data=event) for event in events]
+        wallets = Wallet.objects.select_related('user', 'currency').in_bulk(
+            {serializer.validated_data['wallet_id'] for serializer in serializers if serializer.is_valid()}
+        )
+
+        accepted = []
+        for position, (event, serializer) in enumerate(zip(events, serializers)):
+            if not serializer.is_valid():
+                results[position] = {'success': False, 'message': 'Validation error', 'errors': serializer._errors}
+                continue
+            wallet = wallets.get(serializer.validated_data['wallet_id'])
+            if not wallet:
+                results[position] = {'success': False, 'message': 'Invalid target wallet.'}
+            elif not wallet.is_active:
+                results[position] = {'success': False, 'message': 'Wallet must be active to perform a transfer.'}
+            else:
+                accepted.append((position, event['type'], wallet, serializer.validated_data['amount']))
+
+        try:
+            outcomes = TransactionOperator.apply_atm_events(
+                [(event_type, wallet, amount) for _, event_type, wallet, amount in accepted]
+            )
+        except Exception:
+            events_logger.exception("Applying a chunk of %s bank events failed.", len(accepted))
+            outcomes = [None] * len(accepted)
+
+        for (position, event_type, _, _), outcome in zip(accepted, outcomes):
+            if outcome is None:
+                results[position] = {'success': False, 'message': 'Unexpected error occured'}
+            elif isinstance(outcome, ValueError):
+                results[position] = {'success': False, 'message': str(outcome)}
+            else:
+                if event_type == 'deposit':
+                    NotificationOperator.send_deposit_notification(outcome)
+                else:
+                    NotificationOperator.send_withdrawal_notification(outcome)
+                results[position] = {
+                    'success': True,
+                    'message': 'Money recieved successfully',
+                    'reference': outcome.reference,
+                }
+        return results
+
+
+class BankEventInbox:
+    """
+    Durable inbox for bank events whose outcome the bank doesn't wait for. The webhook stores the
+    event and acknowledges it, workers drain the inbox in batches claimed in the database, events of
+    the same wallet are applied in the order they were received. Only deposits are queued: the ATM
+    needs a withdrawal's real result before it dispenses cash, so withdrawals are always applied
+    synchronously.
+    """
+
+    ASYNC_EVENT_TYPES = ('deposit',)
+
+    @classmethod
+    def accepts(cls, event) -> bool:
+        return settings.BANK_WEBHOOK_ASYNC and isinstance(event, dict) and event.get('type') in cls.ASYNC_EVENT_TYPES
+
+    @staticmethod
+    def enqueue(event) -> BankEvent:
+        return BankEvent.objects.create(event_type=event['type'], payload=event)
+
+    @staticmethod
+    def enqueue_many(events: list) -> list:
+        return BankEvent.objects.bulk_create([BankEvent(event_type=event['type'], payload=event) for event in events])
+
+    @classmethod
+    def drain(cls, batch_size: int, max_batches: int) -> int:
+        """
+        Process up to ``max_batches`` batches of pending events and return how many were handled.
+
+        A batch is claimed with ``SELECT ... FOR UPDATE SKIP LOCKED`` and handled in the transaction
+        holding the locks, so workers draining at the same time take disjoint batches and an event's
+        effects commit together with its status. Events of a wallet with an older event still pending
+        outside the batch, claimed by another worker, are left for a later drain.
+        """
+        db = router.db_for_write(BankEvent)
+        handler = EventsHandler()
+        processed = 0
+        deferred = set()
+        for _ in range(max_batches):
+            with atomic(using=db):
+                events = list(
+                    BankEvent.objects.using(db)
+                    .select_for_update(skip_locked=True)
+                    .filter(status=BankEvent.Status.PENDING)
+                    .exclude(id__in=deferred)
+                    .order_by('id')[:batch_size]
+                )
+                blocked = cls._blocked_wallets(events, db)
+                for event in events:
+                    if event.payload.get('wallet_id') in blocked:
+                        deferred.add(event.id)
+                        continue
+                    with atomic(using=db):
+                        result = handler.handle_event(event.payload)
+                        event.status = BankEvent.Status.PROCESSED if result['success'] else BankEvent.Status.FAILED
+                        event.result = result
+                        event.processed_at = timezone.now()
+                        event.save(update_fields=['status', 'result', 'processed_at'])
+                        processed += 1
+            if len(events) < batch_size:
+                break
+        return processed
+
+    @staticmethod
+    def _blocked_wallets(events: list, db: str) -> set:
+        """
+        Wallets of ``events`` with an older pending event that isn't part of the batch.
+        """
+        if not events:
+            return set()
+        first = {}
+        for event in events:
+            first.setdefault(event.payload.get('wallet_id'), event.id)
+        older = (
+            BankEvent.objects.using(db)
+            .filter(status=BankEvent.Status.PENDING, id__lt=events[-1].id)
+            .exclude(id__in=[event.id for event in events])
+            .values_list('id', 'payload__wallet_id')
+        )
+        return {wallet_id for event_id, wallet_id in older if wallet_id in first and event_id < first[wallet_id]}
@@ -0,0 +1,286 @@
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.db import connections, router
+from django.db.models import Case, DecimalField, F, Max, OuterRef, Subquery, Sum, When
+from django.db.transaction import atomic
+from django.utils import timezone
+
+from .models import BalanceCheckpoint, LedgerEntry, Wallet, WalletShard
+
+SIGNED_AMOUNT = Case(
+    When(direction=LedgerEntry.Direction.CREDIT, then=F('amount')),
+    default=-F('amount'),
+    output_field=DecimalField(max_digits=14, decimal_places=2),
+)
+
+
+class InsufficientBalance(ValueError):
+    pass
+
+
+class DailyLimitExceeded(ValueError):
+    pass
+
+
+class WalletLedger:
+    """
+    Applies balance and daily counter changes to a wallet row as a single guarded
+    ``UPDATE ... RETURNING`` statement, so concurrent postings never overwrite each other
+    and a wallet is never loaded, mutated and saved back as a whole.
+    """
+
+    DAILY_COUNTERS = {
+        'transferred_today': ('Transfer', 'transfer'),
+        'withdrawn_today': ('Withdrawal', 'withdraw'),
+    }
+    RETURNING = 'balance, transferred_today, withdrawn_today, spends_date'
+
+    @staticmethod
+    def _execute(sql: str, params):
+        connection = connections[router.db_for_write(Wallet)]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchone()
+
+    @staticmethod
+    def _apply(wallet: Wallet, row) -> Wallet:
+        wallet.balance, wallet.transferred_today, wallet.withdrawn_today, wallet.spends_date = row
+        return wallet
+
+    @classmethod
+    def debit(cls, wallet: Wallet, amount: Decimal, counter: str, limit: Decimal) -> Wallet:
+        """
+        Take ``amount`` out of the wallet and add it to the ``counter`` daily spend, only if the
+        balance covers it and the counter stays within ``limit``.
+
+        Sharded wallets are debited from the main row, their shards are folded into it first
+        when the main row alone can't cover the amount.
+        """
+        if counter not in cls.DAILY_COUNTERS:
+            raise ValueError(f"Unknown daily counter '{counter}'.")
+
+        try:
+            return cls._debit(wallet, amount, counter, limit)
+        except InsufficientBalance:
+            if not wallet.shard_count or not cls.compact(wallet):
+                raise
+        return cls._debit(wallet, amount, counter, limit)
+
+    @classmethod
+    def _debit(cls, wallet: Wallet, amount: Decimal, counter: str, limit: Decimal) -> Wallet:
+        other_counter = next(name for name in cls.DAILY_COUNTERS if name != counter)
+        # counters carry the day they belong to and start from zero on the first posting of a new day
+        row = cls._execute(
+            f"""
+            UPDATE {Wallet._meta.db_table}
+            SET balance = balance - %(amount)s,
+                {counter} = CASE WHEN spends_date = %(today)s THEN {counter} ELSE 0 END + %(amount)s,
+                {other_counter} = CASE WHEN spends_date = %(today)s THEN {other_counter} ELSE 0 END,
+                spends_date = %(today)s,
+                updated_at = %(now)s
+            WHERE id = %(wallet_id)s
+                AND balance >= %(amount)s
+                AND CASE WHEN spends_date = %(today)s THEN {counter} ELSE 0 END + %(amount)s <= %(limit)s
+            RETURNING {cls.RETURNING}
+            """,
+            {
+                'amount': amount,
+                'today': timezone.localdate(),
+                'now': timezone.now(),
+                'wallet_id': wallet.pk,
+                'limit': limit,
+            },
+        )
+        if row is not None:
+            return cls._apply(wallet, row)
+
+        # The guard rejected the posting, read the row back to tell the caller why.
+        current = (
+            Wallet.objects.using(router.db_for_write(Wallet))
+            .filter(pk=wallet.pk)
+            .values_list('balance', 'transferred_today', 'withdrawn_today', 'spends_date')
+            .first()
+        )
+        if current is None:
+            raise ValueError("Wallet not found.")
+        cls._apply(wallet, current)
+
+        spent_today = wallet.spent_today(counter)
+        if spent_today + amount > limit:
+            title, verb = cls.DAILY_COUNTERS[counter]
+            raise DailyLimitExceeded(
+                f"{title} limit exceeded. You can only {verb} {limit - spent_today} {wallet.currency} today."
+            )
+        raise InsufficientBalance("Insufficient balance")
+
+    @classmethod
+    def credit(cls, wallet: Wallet, amount: Decimal, key: str = None) -> Wallet:
+        """
+        Add ``amount`` to the wallet. Sharded wallets take the credit on the sub-balance picked by
+        hashing ``key``, so concurrent credits to one wallet don't queue on the same row lock.
+        """
+        if wallet.shard_count and cls._credit_shard(wallet, amount, key):
+            return wallet
+        return cls._credit(wallet, amount)
+
+    @classmethod
+    def _credit(cls, wallet: Wallet, amount: Decimal) -> Wallet:
+        row = cls._execute(
+            f"""
+            UPDATE {Wallet._meta.db_table}
+            SET balance = balance + %s, updated_at = %s
+            WHERE id = %s
+            RETURNING {cls.RETURNING}
+            """,
+            [amount, timezone.now(), wallet.pk],
+        )
+        if row is None:
+            raise ValueError("Wallet not found.")
+        return cls._apply(wallet, row)
+
+    @classmethod
+    def credit_many(cls, credits: list) -> None:
+        """
+        Apply several ``(wallet, amount)`` credits to distinct wallets. Sharded wallets take theirs on
+        a shard, all the others are credited together by one ``UPDATE ... FROM (VALUES ...)``.
+        """
+        wallets, params = {}, []
+        for wallet, amount in credits:
+            if wallet.shard_count and cls._credit_shard(wallet, amount, uuid.uuid4().hex):
+                continue
+            wallets[wallet.pk] = wallet
+            params.extend([wallet.pk, amount])
+        if not wallets:
+            return
+
+        values = ', '.join(['(%s::bigint, %s::numeric)'] * len(wallets))
+        connection = connections[router.db_for_write(Wallet)]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE {Wallet._meta.db_table} AS wallet
+                SET balance = wallet.balance + credit.amount, updated_at = %s
+                FROM (VALUES {values}) AS credit (id, amount)
+                WHERE wallet.id = credit.id
+                RETURNING wallet.id, {cls.RETURNING}
+                """,
+                [timezone.now(), *params],
+            )
+            for wallet_id, *row in cursor.fetchall():
+                cls._apply(wallets[wallet_id], row)
+
+    @staticmethod
+    def shard_index(wallet: Wallet, key: str = None) -> int:
+        key = key or uuid.uuid4().hex
+        return zlib.crc32(key.encode()) % wallet.shard_count
+
+    @classmethod
+    def _credit_shard(cls, wallet: Wallet, amount: Decimal, key: str = None) -> bool:
+        updated = WalletShard.objects.filter(wallet=wallet, index=cls.shard_index(wallet, key)).update(
+            balance=F('balance') + amount, updated_at=timezone.now()
+        )
+        return bool(updated)
+
+    @staticmethod
+    def enable_sharding(wallet: Wallet, shard_count: int) -> Wallet:
+        """
+        Spread future credits to ``wallet`` over ``shard_count`` sub-balances, 0 turns sharding off.
+        Existing shards are compacted into the main balance before the layout changes.
+        """
+        with atomic():
+            WalletLedger.compact(wallet)
+            WalletShard.objects.filter(wallet=wallet, index__gte=shard_count).delete()
+            WalletShard.objects.bulk_create(
+                [WalletShard(wallet=wallet, index=index) for index in range(shard_count)], ignore_conflicts=True
+            )
+            Wallet.objects.filter(pk=wallet.pk).update(shard_count=shard_count)
+        wallet.shard_count = shard_count
+        return wallet
+
+    @classmethod
+    def compact(cls, wallet: Wallet) -> Decimal:
+        """
+        Fold every shard of ``wallet`` back into its main balance and return the amount moved.
+        """
+        with atomic():
+            shards = list(
+                WalletShard.objects.select_for_update()
+                .filter(wallet=wallet, balance__gt=Decimal('0.00'))
+                .values_list('id', 'balance')
+            )
+            if not shards:
+                return Decimal('0.00')
+            amount = sum(balance for _, balance in shards)
+            WalletShard.objects.filter(id__in=[shard_id for shard_id, _ in shards]).update(
+                balance=Decimal('0.00'), updated_at=timezone.now()
+            )
+            cls._credit(wallet, amount)
+        return amount
+
+    @staticmethod
+    def record(*movements: list) -> list:
+        """
+        Append the legs built by ``LedgerEntry.legs`` for one or more movements in a single insert.
+        """
+        return LedgerEntry.objects.bulk_create([entry for legs in movements for entry in legs])
+
+    @staticmethod
+    def ledger_balance(wallet: Wallet, at: datetime = None) -> Decimal:
+        """
+        Balance of ``wallet`` from its latest checkpoint plus the entries posted after it, optionally
+        as it was at ``at``. Returns ``None`` when no checkpoint is old enough to start from.
+        """
+        checkpoints = BalanceCheckpoint.objects.filter(wallet=wallet)
+        entries = LedgerEntry.objects.filter(wallet=wallet)
+        if at:
+            checkpoints = checkpoints.filter(as_of__lte=at)
+            entries = entries.filter(created_at__lte=at)
+
+        checkpoint = checkpoints.order_by('-last_entry_id').first()
+        if checkpoint is None:
+            return None
+        tail = entries.filter(id__gt=checkpoint.last_entry_id).aggregate(total=Sum(SIGNED_AMOUNT))['total']
+        return checkpoint.balance + (tail or Decimal('0.00'))
+
+    @staticmethod
+    def checkpoint_balances(settle: timedelta = timedelta(minutes=1)) -> list:
+        """
+        Write a new checkpoint for every wallet with entries after its latest one. Entries younger
+        than ``settle`` are left for the next run so a slow, still uncommitted posting is never skipped.
+        """
+        cutoff_id = LedgerEntry.objects.filter(created_at__lt=timezone.now() - settle).aggregate(last=Max('id'))['last']
+        if not cutoff_id:
+            return []
+
+        latest_checkpoint = BalanceCheckpoint.objects.filter(wallet=OuterRef('wallet')).order_by('-last_entry_id')
+        tails = list(
+            LedgerEntry.objects.filter(wallet__isnull=False, id__lte=cutoff_id)
+            .annotate(checkpoint_entry_id=Subquery(latest_checkpoint.values('last_entry_id')[:1]))
+            .filter(id__gt=F('checkpoint_entry_id'))
+            .values('wallet')
+            .annotate(delta=Sum(SIGNED_AMOUNT), last_entry_id=Max('id'), as_of=Max('created_at'))
+            .order_by()
+        )
+        if not tails:
+            return []
+
+        previous = {
+            checkpoint.wallet_id: checkpoint.balance
+            for checkpoint in BalanceCheckpoint.objects.filter(wallet_id__in=[tail['wallet'] for tail in tails])
+            .order_by('wallet_id', '-last_entry_id')
+            .distinct('wallet_id')
+        }
+        return BalanceCheckpoint.objects.bulk_create(
+            [
+                BalanceCheckpoint(
+                    wallet_id=tail['wallet'],
+                    balance=previous[tail['wallet']] + tail['delta'],
+                    last_entry_id=tail['last_entry_id'],
+                    as_of=tail['as_of'],
+                )
+                for tail in tails
+            ]
+        )
@@ -0,0 +1,157 @@
+import threading
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+
+from cachetools import TTLCache
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router
+from django.utils import timezone
+
+from .models import TierCurrencyLimit, Transaction, Wallet
+
+_MISSING = object()
+
+
+class TierLimitCache:
+    """
+    Two-level cache of ``TierCurrencyLimit`` rows keyed by ``(tier_id, currency_id)``: a small
+    in-process TTL cache in front of the shared cache, falling back to the database on a miss.
+
+    Saving or deleting a tier or a limit drops the shared entries and this process' local cache,
+    other processes pick the change up once their local entries expire.
+    """
+
+    _local = TTLCache(maxsize=1024, ttl=settings.TIER_LIMITS_LOCAL_TTL)
+    _lock = threading.Lock()
+
+    @staticmethod
+    def cache_key(tier_id: int, currency_id: int) -> str:
+        return f"tier-limit:{tier_id}:{currency_id}"
+
+    @classmethod
+    def get(cls, tier_id: int, currency_id: int) -> TierCurrencyLimit:
+        key = cls.cache_key(tier_id, currency_id)
+        with cls._lock:
+            limit = cls._local.get(key, _MISSING)
+        if limit is not _MISSING:
+            return limit
+
+        limit = cache.get(key, _MISSING)
+        if limit is _MISSING:
+            limit = TierCurrencyLimit.objects.filter(tier_id=tier_id, currency_id=currency_id).first()
+            cache.set(key, limit, timeout=settings.TIER_LIMITS_CACHE_TTL)
+
+        with cls._lock:
+            cls._local[key] = limit
+        return limit
+
+    @classmethod
+    def invalidate(cls, tier_id: int, currency_ids) -> None:
+        cache.delete_many([cls.cache_key(tier_id, currency_id) for currency_id in currency_ids])
+        with cls._lock:
+            cls._local.clear()
+
+
+class TransactionsLimitExceeded(ValueError):
+    pass
+
+
+class DailyTransactionCounter:
+    """
+    Per-wallet count of today's outgoing transactions (transfers out and withdrawals) kept in the
+    shared cache under a key that expires at the end of the day, so checking the tier's
+    ``daily_transactions_limit`` is a single ``INCR``. A missing counter is rebuilt from the
+    database once, the first time the wallet transacts that day on a cold cache.
+    """
+
+    COUNTED_TYPES = (Transaction.TransactionType.TRANSFER_OUT, Transaction.TransactionType.WITHDRAWAL)
+
+    @staticmethod
+    def cache_key(wallet_id: int, day) -> str:
+        return f"txn-count:{wallet_id}:{day.isoformat()}"
+
+    @staticmethod
+    def _seconds_until_tomorrow(day) -> int:
+        tomorrow = timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+        return max(int((tomorrow - timezone.now()).total_seconds()), 0) + 1
+
+    @classmethod
+    def _count_from_db(cls, wallet_id: int, day) -> int:
+        return (
+            Transaction.objects.using(router.db_for_write(Transaction))
+            .filter(
+                wallet_id=wallet_id,
+                transaction_type__in=cls.COUNTED_TYPES,
+                created_at__gte=timezone.make_aware(datetime.combine(day, time.min)),
+            )
+            .count()
+        )
+
+    @classmethod
+    def acquire(cls, wallet: Wallet, limit: int) -> int:
+        """
+        Count one more transaction for ``wallet`` today and return the new count, raises
+        ``TransactionsLimitExceeded`` (without counting it) when that goes over ``limit``.
+        """
+        day = timezone.localdate()
+        key = cls.cache_key(wallet.pk, day)
+        try:
+            count = cache.incr(key)
+        except ValueError:
+            # add() keeps whichever worker seeded the counter first, both increments still land on it
+            cache.add(key, cls._count_from_db(wallet.pk, day), timeout=cls._seconds_until_tomorrow(day))
+            count = cache.incr(key)
+
+        if count > limit:
+            cls.release(wallet)
+            raise cls.limit_exceeded(limit)
+        return count
+
+    @classmethod
+    def acquire_many(cls, wallet: Wallet, limit: int, count: int) -> int:
+        """
+        Count up to ``count`` more transactions for ``wallet`` today with a single ``INCR`` and return
+        how many fit within ``limit``, the others are given back straight away.
+        """
+        day = timezone.localdate()
+        key = cls.cache_key(wallet.pk, day)
+        try:
+            total = cache.incr(key, count)
+        except ValueError:
+            cache.add(key, cls._count_from_db(wallet.pk, day), timeout=cls._seconds_until_tomorrow(day))
+            total = cache.incr(key, count)
+
+        rejected = min(max(total - limit, 0), count)
+        if rejected:
+            cls.release(wallet, rejected)
+        return count - rejected
+
+    @staticmethod
+    def limit_exceeded(limit: int) -> TransactionsLimitExceeded:
+        return TransactionsLimitExceeded(
+            f"Transactions limit exceeded. You can only make {limit} transactions per day."
+        )
+
+    @classmethod
+    def release(cls, wallet: Wallet, count: int = 1) -> None:
+        """
+        Give back transactions counted by ``acquire`` that didn't go through.
+        """
+        try:
+            cache.decr(cls.cache_key(wallet.pk, timezone.localdate()), count)
+        except ValueError:
+            pass
+
+    @classmethod
+    @contextmanager
+    def reserve(cls, wallet: Wallet, limit: int):
+        """
+        Count a transaction for the duration of the block, released again if the block raises.
+        """
+        cls.acquire(wallet, limit)
+        try:
+            yield
+        except BaseException:
+            cls.release(wallet)
+            raise
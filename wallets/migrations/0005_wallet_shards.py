@@ -0,0 +1,50 @@
+# Generated by Django 5.2.1 on 2026-10-18 20:12
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0004_remove_tier_limits'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wallet',
+            name='shard_count',
+            field=models.PositiveSmallIntegerField(
+                default=0, help_text='Number of sub-balance rows incoming credits are spread over, 0 disables sharding'
+            ),
+        ),
+        migrations.CreateModel(
+            name='WalletShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField()),
+                ('balance', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                (
+                    'wallet',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='wallets.wallet'
+                    ),
+                ),
+            ],
+            options={
+                'verbose_name': 'Wallet Shard',
+                'verbose_name_plural': 'Wallet Shards',
+                'ordering': ['wallet', 'index'],
+                'constraints': [
+                    models.CheckConstraint(
+                        condition=models.Q(('balance__gte', Decimal('0.00'))), name='shard_balance_non_negative'
+                    ),
+                    models.UniqueConstraint(fields=('wallet', 'index'), name='unique_shard_index_per_wallet'),
+                ],
+            },
+        ),
+    ]
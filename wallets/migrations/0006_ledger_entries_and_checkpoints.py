@@ -0,0 +1,119 @@
+# Generated by Django 5.2.1 on 2026-10-18 20:15
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+from django.utils import timezone
+
+
+def create_opening_checkpoints(apps, schema_editor):
+    Wallet = apps.get_model('wallets', 'Wallet')
+    BalanceCheckpoint = apps.get_model('wallets', 'BalanceCheckpoint')
+    db_alias = schema_editor.connection.alias
+    now = timezone.now()
+    wallets = Wallet.objects.using(db_alias).annotate(shards_balance=Sum('shards__balance'))
+    BalanceCheckpoint.objects.using(db_alias).bulk_create(
+        [
+            BalanceCheckpoint(wallet=wallet, balance=wallet.balance + (wallet.shards_balance or 0), as_of=now)
+            for wallet in wallets.iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0005_wallet_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('last_entry_id', models.BigIntegerField(default=0)),
+                ('as_of', models.DateTimeField(help_text='Time of the last ledger entry included in the balance')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                (
+                    'wallet',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='balance_checkpoints',
+                        to='wallets.wallet',
+                    ),
+                ),
+            ],
+            options={
+                'verbose_name': 'Balance Checkpoint',
+                'verbose_name_plural': 'Balance Checkpoints',
+                'ordering': ['-last_entry_id'],
+                'indexes': [
+                    models.Index(fields=['wallet', '-last_entry_id'], name='wallets_bal_wallet__11edc3_idx'),
+                    models.Index(fields=['wallet', '-as_of'], name='wallets_bal_wallet__c2b1a3_idx'),
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reference', models.CharField(max_length=100)),
+                (
+                    'account',
+                    models.CharField(
+                        choices=[('WALLET', 'Wallet'), ('ATM', 'ATM/Cash'), ('BANK', 'Bank Transfer')], max_length=10
+                    ),
+                ),
+                ('direction', models.CharField(choices=[('DEBIT', 'Debit'), ('CREDIT', 'Credit')], max_length=6)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                (
+                    'transaction',
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name='ledger_entries',
+                        to='wallets.transaction',
+                    ),
+                ),
+                (
+                    'wallet',
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name='ledger_entries',
+                        to='wallets.wallet',
+                    ),
+                ),
+            ],
+            options={
+                'verbose_name': 'Ledger Entry',
+                'verbose_name_plural': 'Ledger Entries',
+                'ordering': ['-id'],
+                'indexes': [
+                    models.Index(fields=['wallet', 'id'], name='wallets_led_wallet__cc8cf4_idx'),
+                    models.Index(fields=['reference'], name='wallets_led_referen_64fecd_idx'),
+                ],
+                'constraints': [
+                    models.CheckConstraint(
+                        condition=models.Q(('amount__gt', Decimal('0.00'))), name='ledger_amount_positive'
+                    ),
+                    models.CheckConstraint(
+                        condition=models.Q(
+                            models.Q(('account', 'WALLET'), ('wallet__isnull', False)),
+                            models.Q(models.Q(('account', 'WALLET'), _negated=True), ('wallet__isnull', True)),
+                            _connector='OR',
+                        ),
+                        name='ledger_wallet_matches_account',
+                    ),
+                ],
+            },
+        ),
+        migrations.RunPython(create_opening_checkpoints, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.1 on 2026-10-18 20:23
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def stamp_current_spends(apps, schema_editor):
+    # counters present at deploy time belong to today, keep them until the first posting of tomorrow
+    Wallet = apps.get_model('wallets', 'Wallet')
+    Wallet.objects.using(schema_editor.connection.alias).update(spends_date=timezone.localdate())
+
+
+def remove_daily_reset_task(apps, schema_editor):
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+    PeriodicTask.objects.using(schema_editor.connection.alias).filter(task='wallets.tasks.set_wallets_spends').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0006_ledger_entries_and_checkpoints'),
+        ('django_celery_beat', '0019_alter_periodictasks_options'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wallet',
+            name='spends_date',
+            field=models.DateField(
+                blank=True, help_text='Day the transferred/withdrawn today counters belong to', null=True
+            ),
+        ),
+        migrations.RunPython(stamp_current_spends, migrations.RunPython.noop),
+        migrations.RunPython(remove_daily_reset_task, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-18 20:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0007_wallet_spends_date'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(
+                condition=models.Q(('status', 'PENDING')), fields=['expires_at'], name='transaction_pending_expiry_idx'
+            ),
+        ),
+    ]
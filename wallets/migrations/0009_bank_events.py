@@ -0,0 +1,42 @@
+# Generated by Django 5.2.1 on 2026-10-18 20:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0008_transaction_pending_expiry_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BankEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_type', models.CharField(max_length=20)),
+                ('payload', models.JSONField()),
+                (
+                    'status',
+                    models.CharField(
+                        choices=[('PENDING', 'Pending'), ('PROCESSED', 'Processed'), ('FAILED', 'Failed')],
+                        default='PENDING',
+                        max_length=10,
+                    ),
+                ),
+                ('result', models.JSONField(blank=True, help_text='Response of the event handler', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Bank Event',
+                'verbose_name_plural': 'Bank Events',
+                'ordering': ['id'],
+                'indexes': [
+                    models.Index(
+                        condition=models.Q(('status', 'PENDING')), fields=['id'], name='bank_event_pending_idx'
+                    )
+                ],
+            },
+        ),
+    ]
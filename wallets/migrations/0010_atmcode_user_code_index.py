@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-18 20:42
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0009_bank_events'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='atmcode',
+            index=models.Index(fields=['user', 'code'], name='wallets_atm_user_id_8bcaf5_idx'),
+        ),
+    ]
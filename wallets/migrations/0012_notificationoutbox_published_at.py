@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 21:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0011_notification_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationoutbox',
+            name='published_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
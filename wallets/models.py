@@ -33,10 +33,24 @@ class Wallet(models.Model):
         default=Decimal('0.00'),
         help_text=_('Amount that has been withdrawn today from this wallet'),
     )
+    spends_date = models.DateField(
+        null=True, blank=True, help_text=_('Day the transferred/withdrawn today counters belong to')
+    )
+    shard_count = models.PositiveSmallIntegerField(
+        default=0,
+        help_text=_('Number of sub-balance rows incoming credits are spread over, 0 disables sharding'),
+    )
     is_active = models.BooleanField(default=True)
     updated_at = models.DateTimeField(auto_now=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # other columns a field's serialized value is computed from, query_optimizer loads them along with it
+    FIELD_DEPENDENCIES = {
+        'balance': ('shard_count',),
+        'transferred_today': ('spends_date',),
+        'withdrawn_today': ('spends_date',),
+    }
+
     class Meta:
         verbose_name = _('Wallet')
         verbose_name_plural = _('Wallets')
@@ -58,6 +72,41 @@ class Wallet(models.Model):
     def __str__(self):
         return f"{self.user.first_name} {self.user.last_name}'s ({self.user.phone_number}) Wallet - {self.currency.currency_code} {self.balance:.2f}"
 
+    def spent_today(self, counter: str) -> Decimal:
+        """
+        Value of the ``transferred_today`` or ``withdrawn_today`` counter, counters left over from an
+        earlier day count as zero.
+        """
+        if self.spends_date != timezone.localdate():
+            return Decimal('0.00')
+        return getattr(self, counter)
+
+    def total_balance(self) -> Decimal:
+        if not self.shard_count:
+            return self.balance
+        shards_balance = self.shards.aggregate(total=models.Sum('balance'))['total'] or Decimal('0.00')
+        return self.balance + shards_balance
+
+
+class WalletShard(models.Model):
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='shards')
+    index = models.PositiveSmallIntegerField()
+    balance = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    updated_at = models.DateTimeField(auto_now=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('Wallet Shard')
+        verbose_name_plural = _('Wallet Shards')
+        ordering = ['wallet', 'index']
+        constraints = [
+            models.CheckConstraint(check=models.Q(balance__gte=Decimal('0.00')), name='shard_balance_non_negative'),
+            models.UniqueConstraint(fields=['wallet', 'index'], name='unique_shard_index_per_wallet'),
+        ]
+
+    def __str__(self):
+        return f"Shard {self.index} of wallet {self.wallet_id} - {self.balance:.2f}"
+
 
 class Transaction(models.Model):
     class TransactionType(models.TextChoices):
@@ -80,6 +129,8 @@ class Transaction(models.Model):
         EXPIRED = 'EXPIRED', _('Expired')
         CANCELED = 'CANCELED', _('Canceled')
 
+    PENDING_TTL = timedelta(minutes=10)
+
     wallet = models.ForeignKey(Wallet, on_delete=models.PROTECT, related_name='transactions')
     amount = models.DecimalField(max_digits=12, decimal_places=2)
     transaction_type = models.CharField(max_length=12, choices=TransactionType.choices)
@@ -101,6 +152,10 @@ class Transaction(models.Model):
         indexes = [
             models.Index(fields=['wallet', 'transaction_type', 'status']),
             models.Index(fields=['reference']),
+            # only pending rows can expire, keep the sweeper's index as small as the pending set
+            models.Index(
+                fields=['expires_at'], condition=models.Q(status='PENDING'), name='transaction_pending_expiry_idx'
+            ),
         ]
 
     def __str__(self):
@@ -110,7 +165,7 @@ class Transaction(models.Model):
         if not self.reference and not self.pk:
             self.reference = generate_reference(prefix='TXN')
         if not self.expires_at and not self.pk:
-            self.expires_at = timezone.now() + timedelta(minutes=10)
+            self.expires_at = timezone.now() + self.PENDING_TTL
         super().save(*args, **kwargs)
 
     def is_expired(self):
@@ -118,6 +173,152 @@ class Transaction(models.Model):
             return timezone.now() > self.expires_at and self.status == self.Status.PENDING
 
 
+class LedgerEntry(models.Model):
+    """
+    One leg of a double-entry posting. Entries are only ever inserted, every money movement writes
+    a debit leg and a credit leg of the same amount under the same reference.
+    """
+
+    class Account(models.TextChoices):
+        WALLET = 'WALLET', _('Wallet')
+        ATM = 'ATM', _('ATM/Cash')
+        BANK = 'BANK', _('Bank Transfer')
+
+    class Direction(models.TextChoices):
+        DEBIT = 'DEBIT', _('Debit')
+        CREDIT = 'CREDIT', _('Credit')
+
+    reference = models.CharField(max_length=100)
+    transaction = models.ForeignKey(
+        Transaction, on_delete=models.PROTECT, related_name='ledger_entries', null=True, blank=True
+    )
+    wallet = models.ForeignKey(Wallet, on_delete=models.PROTECT, related_name='ledger_entries', null=True, blank=True)
+    account = models.CharField(max_length=10, choices=Account.choices)
+    direction = models.CharField(max_length=6, choices=Direction.choices)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('Ledger Entry')
+        verbose_name_plural = _('Ledger Entries')
+        ordering = ['-id']
+        constraints = [
+            models.CheckConstraint(check=models.Q(amount__gt=Decimal('0.00')), name='ledger_amount_positive'),
+            models.CheckConstraint(
+                check=models.Q(account='WALLET', wallet__isnull=False)
+                | (~models.Q(account='WALLET') & models.Q(wallet__isnull=True)),
+                name='ledger_wallet_matches_account',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['wallet', 'id']),
+            models.Index(fields=['reference']),
+        ]
+
+    def __str__(self):
+        return f"{self.direction} {self.account} {self.amount} ({self.reference})"
+
+    @classmethod
+    def legs(cls, reference: str, amount: Decimal, debit, credit, transaction=None) -> list:
+        """
+        Build the unsaved debit and credit entries of one movement, ``debit`` and ``credit`` are
+        either a ``Wallet`` or an external ``Account``.
+        """
+        return [
+            cls._leg(reference, amount, debit, cls.Direction.DEBIT, transaction),
+            cls._leg(reference, amount, credit, cls.Direction.CREDIT, transaction),
+        ]
+
+    @classmethod
+    def _leg(cls, reference, amount, side, direction, transaction):
+        if isinstance(side, Wallet):
+            return cls(
+                reference=reference,
+                transaction=transaction,
+                wallet=side,
+                account=cls.Account.WALLET,
+                direction=direction,
+                amount=amount,
+            )
+        return cls(reference=reference, transaction=transaction, account=side, direction=direction, amount=amount)
+
+
+class BalanceCheckpoint(models.Model):
+    """
+    Balance of a wallet once every ledger entry up to ``last_entry_id`` is applied.
+    """
+
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='balance_checkpoints')
+    balance = models.DecimalField(max_digits=12, decimal_places=2)
+    last_entry_id = models.BigIntegerField(default=0)
+    as_of = models.DateTimeField(help_text=_('Time of the last ledger entry included in the balance'))
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('Balance Checkpoint')
+        verbose_name_plural = _('Balance Checkpoints')
+        ordering = ['-last_entry_id']
+        indexes = [
+            models.Index(fields=['wallet', '-last_entry_id']),
+            models.Index(fields=['wallet', '-as_of']),
+        ]
+
+    def __str__(self):
+        return f"Wallet {self.wallet_id} balance {self.balance:.2f} as of {self.as_of.strftime('%Y-%m-%d %H:%M:%S')}"
+
+
+class BankEvent(models.Model):
+    """
+    Bank webhook event accepted for asynchronous processing, drained by workers in id order.
+    """
+
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', _('Pending')
+        PROCESSED = 'PROCESSED', _('Processed')
+        FAILED = 'FAILED', _('Failed')
+
+    event_type = models.CharField(max_length=20)
+    payload = models.JSONField()
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    result = models.JSONField(null=True, blank=True, help_text=_('Response of the event handler'))
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = _('Bank Event')
+        verbose_name_plural = _('Bank Events')
+        ordering = ['id']
+        indexes = [models.Index(fields=['id'], condition=models.Q(status='PENDING'), name='bank_event_pending_idx')]
+
+    def __str__(self):
+        return f"{self.event_type} event {self.pk} ({self.status})"
+
+
+class NotificationOutbox(models.Model):
+    """
+    SMS notification written in the same database transaction as the change it reports, handed to
+    the SMS task only once that transaction has committed. ``published_at`` is when it was last handed
+    to the task, ``sent_at`` when the provider accepted it.
+    """
+
+    phone_number = models.CharField(max_length=15)
+    message = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    published_at = models.DateTimeField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = _('Notification Outbox Message')
+        verbose_name_plural = _('Notification Outbox')
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(sent_at__isnull=True), name='notification_outbox_unsent_idx')
+        ]
+
+    def __str__(self):
+        return f"SMS to {self.phone_number} ({'sent' if self.sent_at else 'pending'})"
+
+
 class ATMCode(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -135,6 +336,7 @@ class ATMCode(models.Model):
         verbose_name = _('ATM Code')
         verbose_name_plural = _('ATM Codes')
         ordering = ['-created_at']
+        indexes = [models.Index(fields=['user', 'code'])]
 
     def __str__(self):
         return self.code
@@ -149,6 +351,23 @@ class ATMCode(models.Model):
     def is_valid(self):
         return not self.is_used and timezone.now() < self.expires_at
 
+    @classmethod
+    def claim(cls, phone_number: str, code: str) -> bool:
+        """
+        Mark the unused, unexpired ``code`` of the user with ``phone_number`` as used in a single
+        conditional ``UPDATE``, returns whether a code was claimed. Two terminals racing for the same
+        code can't both claim it.
+        """
+        user_model = cls._meta.get_field('user').related_model
+        now = timezone.now()
+        claimed = cls.objects.filter(
+            user_id=models.Subquery(user_model.objects.filter(phone_number=phone_number).values('id')[:1]),
+            code=code,
+            is_used=False,
+            expires_at__gt=now,
+        ).update(is_used=True, updated_at=now)
+        return bool(claimed)
+
     def mark_as_used(self):
         if not self.is_used:
             self.is_used = True
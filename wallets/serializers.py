@@ -1,42 +1,92 @@
 from decimal import Decimal
 
+from django.db.models import Sum
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
 
 from core.base.serializers import BaseModelSerializer, BaseSerializer
 from utilities.serializers import CurrencySerializer
 
-from .models import Tier, TierCurrencyLimit, Transaction, Wallet
+from .models import Tier, TierCurrencyLimit, Transaction, Wallet, WalletShard
 
 
 class WalletSerializer(BaseModelSerializer):
     class Meta:
         model = Wallet
         fields = '__all__'
-        read_only_fields = ('id', 'balance', 'created_at', 'updated_at', 'transferred_today', 'withdrawn_today')
+        read_only_fields = (
+            'id',
+            'balance',
+            'created_at',
+            'updated_at',
+            'transferred_today',
+            'withdrawn_today',
+            'spends_date',
+            'shard_count',
+        )
+
+    def update(self, instance, validated_data):
+        # never write balance/spend columns back from a stale instance, the ledger owns them
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        instance.save(update_fields=list({*validated_data, 'name', 'updated_at'}))
+        return instance
+
+    def represent_values(self, rows, representations):
+        """
+        ``to_representation`` adjustments for the ``values()`` rows of ``CompiledListSerializer``.
+        """
+        sharded = [row['id'] for row in rows if row.get('shard_count')] if 'balance' in self.fields else []
+        shard_balances = {}
+        if sharded:
+            shard_balances = dict(
+                WalletShard.objects.filter(wallet_id__in=sharded)
+                .values('wallet')
+                .annotate(total=Sum('balance'))
+                .values_list('wallet', 'total')
+                .order_by()
+            )
+        today = timezone.localdate()
+        for row, representation in zip(rows, representations):
+            if row['id'] in shard_balances:
+                representation['balance'] = self.fields['balance'].to_representation(
+                    row['balance'] + shard_balances[row['id']]
+                )
+            for counter in ('transferred_today', 'withdrawn_today'):
+                if counter in representation and row['spends_date'] != today:
+                    representation[counter] = self.fields[counter].to_representation(Decimal('0.00'))
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
-        expand = self.context.get('request').query_params.get('expand', '')
-        if 'currency' in expand:
-            representation['currency'] = CurrencySerializer(
-                instance.currency, context={'request': self.context.get('request')}
-            ).data
-        if 'transactions' in expand:
+        if 'balance' in representation and instance.shard_count:
+            representation['balance'] = self.fields['balance'].to_representation(instance.total_balance())
+        for counter in ('transferred_today', 'withdrawn_today'):
+            if counter in representation:
+                representation[counter] = self.fields[counter].to_representation(instance.spent_today(counter))
+        if self.is_expanded('currency'):
+            representation['currency'] = CurrencySerializer(instance.currency, **self.nested_options('currency')).data
+        if self.is_expanded('transactions'):
+            # prefetched by query_optimizer
             representation['transactions'] = TransactionSerializer(
-                instance.transactions.all(), many=True, context={'request': self.context.get('request')}
+                instance.transactions.all(), many=True, **self.nested_options('transactions')
             ).data
-        if 'user' in expand:
-            representation['user'] = {
-                'id': instance.user.id,
-                'full_name': f"{instance.user.first_name} {instance.user.last_name}",
-                'phone_number': instance.user.phone_number,
+        if self.is_expanded('user'):
+            options = self.nested_options('user')
+            user_fields = options['fields']
+            user = {
+                'id': lambda: instance.user.id,
+                'full_name': lambda: f"{instance.user.first_name} {instance.user.last_name}",
+                'phone_number': lambda: instance.user.phone_number,
             }
-        if 'user.tier' in expand:
-            representation['user']['tier'] = {
-                'id': instance.user.tier.id,
-                'name': instance.user.tier.name,
+            representation['user'] = {
+                name: value() for name, value in user.items() if not user_fields or name in user_fields
             }
+            if 'tier' in (options['expand'] or {}) and (not user_fields or 'tier' in user_fields):
+                representation['user']['tier'] = {
+                    'id': instance.user.tier.id,
+                    'name': instance.user.tier.name,
+                }
         return representation
 
 
@@ -48,11 +98,11 @@ class TransactionSerializer(BaseModelSerializer):
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
-        expand = self.context.get('request').query_params.get('expand', '')
-        if 'wallet' in expand:
-            representation['wallet'] = WalletSerializer(instance.wallet, context=self.context).data
-        if 'related_wallet' in expand:
-            representation['related_wallet'] = WalletSerializer(instance.related_wallet, context=self.context).data
+        for relation in ('wallet', 'related_wallet'):
+            if self.is_expanded(relation) and getattr(instance, relation) is not None:
+                representation[relation] = WalletSerializer(
+                    getattr(instance, relation), **self.nested_options(relation)
+                ).data
         return representation
 
     def validate(self, attrs):
@@ -88,8 +138,12 @@ class WalletTransferSerializer(BaseSerializer):
         source_wallet_id = attrs.get('source_wallet')
         target_wallet_id = attrs.get('target_wallet')
         amount = attrs.get('amount')
-        source_wallet = Wallet.objects.filter(id=source_wallet_id, user=self.context['request'].user).first()
-        target_wallet = Wallet.objects.filter(id=target_wallet_id).first()
+        source_wallet = (
+            Wallet.objects.select_related('user', 'currency')
+            .filter(id=source_wallet_id, user=self.context['request'].user)
+            .first()
+        )
+        target_wallet = Wallet.objects.select_related('user').filter(id=target_wallet_id).first()
 
         if not source_wallet or not target_wallet:
             raise serializers.ValidationError(_("Invalid source or target wallet."))
@@ -108,7 +162,7 @@ class WalletTransferSerializer(BaseSerializer):
                 raise serializers.ValidationError(_("Amount must be greater than zero."))
         except (ValueError, TypeError):
             raise serializers.ValidationError(_("Invalid amount format."))
-        if source_wallet.balance < amount:
+        if source_wallet.total_balance() < amount:
             raise serializers.ValidationError(_("Source wallet does not have sufficient balance."))
 
         attrs['source_wallet'] = source_wallet
@@ -117,6 +171,60 @@ class WalletTransferSerializer(BaseSerializer):
         return super().validate(attrs)
 
 
+class BulkTransferItemSerializer(BaseSerializer):
+    source_wallet = serializers.IntegerField()
+    target_wallet = serializers.IntegerField()
+    amount = serializers.DecimalField(max_digits=12, decimal_places=2)
+    description = serializers.CharField(max_length=255, required=False, allow_blank=True, default='')
+
+
+class BulkWalletTransferSerializer(BaseSerializer):
+    MAX_TRANSFERS = 1000
+
+    transfers = BulkTransferItemSerializer(many=True, allow_empty=False, max_length=MAX_TRANSFERS)
+
+    def validate(self, attrs):
+        """
+        Resolve the wallets of every transfer in two queries. Invalid transfers get an ``error``
+        instead of failing the whole batch, so the valid ones can still be initiated.
+        """
+        transfers = attrs['transfers']
+        sources = Wallet.objects.select_related('user', 'currency').in_bulk(
+            {transfer['source_wallet'] for transfer in transfers}
+        )
+        targets = Wallet.objects.select_related('user', 'currency').in_bulk(
+            {transfer['target_wallet'] for transfer in transfers}
+        )
+        user = self.context['request'].user
+
+        for transfer in transfers:
+            source_wallet = sources.get(transfer['source_wallet'])
+            if source_wallet and source_wallet.user_id != user.id:
+                source_wallet = None
+            target_wallet = targets.get(transfer['target_wallet'])
+            transfer['source_wallet'] = source_wallet
+            transfer['target_wallet'] = target_wallet
+            transfer['error'] = self._transfer_error(source_wallet, target_wallet, transfer['amount'])
+
+        return super().validate(attrs)
+
+    @staticmethod
+    def _transfer_error(source_wallet, target_wallet, amount):
+        if not source_wallet or not target_wallet:
+            return _("Invalid source or target wallet.")
+        if not source_wallet.is_active or not target_wallet.is_active:
+            return _("Both wallets must be active to perform a transfer.")
+        if source_wallet.currency_id != target_wallet.currency_id:
+            return _("Source and target wallets must have the same currency.")
+        if source_wallet.id == target_wallet.id:
+            return _("Cannot transfer to the same wallet.")
+        if amount <= 0:
+            return _("Amount must be greater than zero.")
+        if source_wallet.total_balance() < amount:
+            return _("Source wallet does not have sufficient balance.")
+        return None
+
+
 class ATMDepositSerializer(BaseSerializer):
     target_wallet = serializers.IntegerField()
     amount = serializers.DecimalField(max_digits=12, decimal_places=2)
@@ -138,16 +246,21 @@ class ATMWithdrawalSerializer(BaseSerializer):
     amount = serializers.DecimalField(max_digits=12, decimal_places=2)
 
     def validate(self, attrs):
-        source_wallet = Wallet.objects.filter(id=attrs.get('source_wallet')).first()
+        source_wallet = Wallet.objects.select_related('user', 'currency').filter(id=attrs.get('source_wallet')).first()
         if not source_wallet:
             raise serializers.ValidationError(_("Invalid target wallet."))
 
         if not source_wallet.is_active:
             raise serializers.ValidationError(_("Wallet must be active to perform a transfer."))
 
-        if source_wallet.balance < Decimal(attrs.get('amount')):
+        if source_wallet.total_balance() < Decimal(attrs.get('amount')):
             raise serializers.ValidationError(_("Source wallet does not have sufficient balance."))
 
         attrs['source_wallet'] = source_wallet
 
         return super().validate(attrs)
+
+
+class BankMoneyEventSerializer(BaseSerializer):
+    wallet_id = serializers.IntegerField()
+    amount = serializers.DecimalField(max_digits=12, decimal_places=2, min_value=Decimal('0.01'))
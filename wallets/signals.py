@@ -0,0 +1,29 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .limits import TierLimitCache
+from .models import BalanceCheckpoint, Tier, TierCurrencyLimit, Wallet
+
+
+@receiver(post_save, sender=Wallet)
+def create_opening_checkpoint(sender, instance, created, **kwargs):
+    if created:
+        # Ledger balances are computed from the latest checkpoint, so every wallet starts with one
+        BalanceCheckpoint.objects.create(wallet=instance, balance=instance.balance, as_of=instance.created_at)
+
+
+@receiver([post_save, post_delete], sender=TierCurrencyLimit)
+def invalidate_tier_currency_limit(sender, instance, using, **kwargs):
+    # after the commit, a miss before it would cache the old row again for the whole TTL
+    transaction.on_commit(partial(TierLimitCache.invalidate, instance.tier_id, [instance.currency_id]), using=using)
+
+
+@receiver([post_save, post_delete], sender=Tier)
+def invalidate_tier_limits(sender, instance, using, **kwargs):
+    currency_ids = (
+        TierCurrencyLimit.objects.using(using).filter(tier_id=instance.id).values_list('currency_id', flat=True)
+    )
+    transaction.on_commit(partial(TierLimitCache.invalidate, instance.id, list(currency_ids)), using=using)
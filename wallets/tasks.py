@@ -1,14 +1,58 @@
 from celery import shared_task
+from django.conf import settings
 
-from .models import Wallet
+from .events import BankEventInbox
+from .ledger import WalletLedger
+from .models import Wallet, WalletShard
+from .utils import NotificationOutboxRelay, TransactionOperator
 
 
 @shared_task
-def set_wallets_spends():
-    wallets = Wallet.objects.all()
+def compact_wallet_shards():
+    wallet_ids = WalletShard.objects.filter(balance__gt=0).values_list('wallet_id', flat=True).distinct()
+    wallets = Wallet.objects.filter(id__in=list(wallet_ids))
 
     for wallet in wallets:
-        wallet.transferred_today = 0
-        wallet.withdrawn_today = 0
-        wallet.save()
-    return f"Updated {len(wallets)} wallets for today's spends."
+        WalletLedger.compact(wallet)
+    return f"Compacted shards of {len(wallets)} wallets."
+
+
+@shared_task
+def checkpoint_wallet_balances():
+    checkpoints = WalletLedger.checkpoint_balances()
+    return f"Checkpointed balances of {len(checkpoints)} wallets."
+
+
+@shared_task
+def expire_pending_transfers(max_batches=20):
+    expired = 0
+    for _ in range(max_batches):
+        batch = TransactionOperator.expire_pending_transfers(settings.TRANSFER_EXPIRY_BATCH_SIZE)
+        expired += batch
+        if batch < settings.TRANSFER_EXPIRY_BATCH_SIZE:
+            break
+    return f"Expired {expired} pending transfers."
+
+
+@shared_task
+def process_bank_events(max_batches=20):
+    processed = BankEventInbox.drain(settings.BANK_EVENTS_BATCH_SIZE, max_batches)
+    return f"Processed {processed} bank events."
+
+
+@shared_task(bind=True, ignore_result=True, max_retries=settings.SMS_MAX_RETRIES)
+def send_outbox_notifications(self, ids):
+    undelivered = NotificationOutboxRelay.deliver(ids)
+    if undelivered:
+        raise self.retry(args=[undelivered], countdown=settings.SMS_RETRY_DELAY * 2**self.request.retries)
+
+
+@shared_task
+def relay_notification_outbox(max_batches=20):
+    relayed = 0
+    for _ in range(max_batches):
+        batch = NotificationOutboxRelay.relay(batch_size=settings.NOTIFICATION_OUTBOX_BATCH_SIZE)
+        relayed += batch
+        if batch < settings.NOTIFICATION_OUTBOX_BATCH_SIZE:
+            break
+    return f"Relayed {relayed} notifications."
@@ -1,16 +1,43 @@
+import json
+import logging
+import threading
+import uuid
+from datetime import timedelta
 from decimal import Decimal
 from unittest.mock import patch
 
+import msgpack
 import pytest
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.transaction import atomic
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 
-from wallets.models import ATMCode, TierCurrencyLimit, Transaction
+from core.base.serializers import CompiledListSerializer
+from core.routers import ReadYourWrites
+from utils.orm_utils import compile_plan
+from wallets.events import BankEventInbox
+from wallets.ledger import WalletLedger
+from wallets.limits import DailyTransactionCounter, TierLimitCache
+from wallets.models import (
+    ATMCode,
+    BankEvent,
+    NotificationOutbox,
+    TierCurrencyLimit,
+    Transaction,
+    Wallet,
+)
 
 WALLET_LIST_CREATE_URL = reverse('wallet-list-create')
 TRANSACTION_LIST_URL = reverse('transaction-list')
+TRANSACTION_EXPORT_URL = reverse('transaction-export')
 REQUEST_ATM_CODE_URL = reverse('request-atm-code')
 TRANSFER_MONEY_URL = reverse('transfer-money')
+BULK_TRANSFER_MONEY_URL = reverse('bulk-transfer-money')
 TRANSFER_ACTION_URL = reverse('transfer-action')
 CANCEL_TRANSFER_URL = reverse('cancel-transfer')
 BANK_WEBHOOK_URL = reverse('bank-webhook')
@@ -20,6 +47,14 @@ def wallet_detail_url(wallet_id):
     return reverse('wallet-detail', kwargs={'pk': wallet_id})
 
 
+def sent_sms(mock_send_outbox_notifications):
+    return [
+        (outbox_message.phone_number, outbox_message.message)
+        for call in mock_send_outbox_notifications.delay.call_args_list
+        for outbox_message in NotificationOutbox.objects.filter(id__in=call.args[0])
+    ]
+
+
 @pytest.mark.django_db(databases=['default', 'replica'], transaction=True)
 class TestWalletListCreateView:
     def test_list_wallets_authenticated_user(self, user_a_client, user_a_primary_usd_wallet, user_a_eur_wallet):
@@ -40,6 +75,91 @@ class TestWalletListCreateView:
         assert user_a_primary_usd_wallet.id in wallet_ids
         assert user_b_primary_usd_wallet.id in wallet_ids
 
+    def test_list_wallets_projects_requested_fields(self, user_a_client, test_user_a, user_a_primary_usd_wallet):
+        params = {'fields': 'id,withdrawn_today,user.phone_number', 'expand': 'user'}
+        with CaptureQueriesContext(connections['replica']) as reads:
+            response = user_a_client.get(WALLET_LIST_CREATE_URL, params)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['data']['results'] == [
+            {
+                'id': user_a_primary_usd_wallet.id,
+                'withdrawn_today': "0.00",
+                'user': {'phone_number': test_user_a.phone_number},
+            }
+        ]
+        assert len(reads) == 2
+
+    def test_list_wallets_expansions_cost_fixed_queries(
+        self, admin_client, user_a_primary_usd_wallet, user_a_eur_wallet, user_b_primary_usd_wallet
+    ):
+        for wallet in (user_a_primary_usd_wallet, user_a_eur_wallet):
+            Transaction.objects.create(
+                wallet=wallet,
+                related_wallet=user_b_primary_usd_wallet,
+                amount=Decimal("10.00"),
+                transaction_type=Transaction.TransactionType.TRANSFER_OUT,
+                money_source=Transaction.MoneySource.WALLET_TO_WALLET,
+                status=Transaction.Status.COMPLETED,
+                reference=f"TXNEXPAND{wallet.id}",
+            )
+        params = {'expand': 'currency,user.tier,transactions.related_wallet'}
+        with CaptureQueriesContext(connections['replica']) as reads:
+            response = admin_client.get(WALLET_LIST_CREATE_URL, params)
+        assert response.status_code == status.HTTP_200_OK
+        # the count, the page and the prefetched transactions with their joined related wallets
+        assert len(reads) == 3
+
+        results = {wallet['id']: wallet for wallet in response.data['data']['results']}
+        wallet = results[user_a_eur_wallet.id]
+        assert wallet['currency']['id'] == user_a_eur_wallet.currency_id
+        assert set(wallet['user']) == {'id', 'full_name', 'phone_number', 'tier'}
+        assert [t['related_wallet']['id'] for t in wallet['transactions']] == [user_b_primary_usd_wallet.id]
+        # related_wallet doesn't expand wallet as well
+        assert wallet['transactions'][0]['wallet'] == user_a_eur_wallet.id
+
+        params = {'fields': 'id,transactions.amount', 'expand': 'transactions'}
+        with CaptureQueriesContext(connections['replica']) as reads:
+            response = admin_client.get(WALLET_LIST_CREATE_URL, params)
+        assert len(reads) == 3
+        results = {wallet['id']: wallet for wallet in response.data['data']['results']}
+        assert results[user_a_eur_wallet.id] == {'id': user_a_eur_wallet.id, 'transactions': [{'amount': "10.00"}]}
+
+    def test_list_wallets_reuses_compiled_query_plan(self, caplog, user_a_client, user_a_primary_usd_wallet):
+        compile_plan.cache_clear()
+        params = {'expand': 'currency,balance,owner', 'fields': 'id.value,currency.symbol,currency.rate,nickname'}
+        with caplog.at_level(logging.WARNING, logger='orm'):
+            for _ in range(2):
+                response = user_a_client.get(WALLET_LIST_CREATE_URL, params)
+                assert response.status_code == status.HTTP_200_OK
+                assert set(response.data['data']['results'][0]) == {'id', 'currency'}
+
+        assert compile_plan.cache_info().hits == 1
+        assert [(record.model, record.param, record.path) for record in caplog.records] == [
+            ('wallets.Wallet', 'expand', 'balance'),
+            ('wallets.Wallet', 'expand', 'owner'),
+            ('wallets.Wallet', 'fields', 'id.value'),
+            ('wallets.Wallet', 'fields', 'currency.rate'),
+            ('wallets.Wallet', 'fields', 'nickname'),
+        ]
+
+    def test_compiled_wallet_list_matches_serializer_output(
+        self, mocker, admin_client, user_a_primary_usd_wallet, user_a_eur_wallet, user_b_primary_usd_wallet
+    ):
+        compiled_rows = mocker.spy(CompiledListSerializer, 'to_representation')
+        WalletLedger.enable_sharding(user_a_eur_wallet, 2)
+        WalletLedger.credit(user_a_eur_wallet, Decimal("12.50"), key="shard")
+        Wallet.objects.filter(pk=user_b_primary_usd_wallet.pk).update(
+            withdrawn_today=Decimal("40.00"), spends_date=timezone.localdate() - timedelta(days=1)
+        )
+
+        for params in ({}, {'fields': 'id,balance,withdrawn_today,updated_at'}):
+            compiled = admin_client.get(WALLET_LIST_CREATE_URL, params)
+            with patch('core.base.views.CompiledListSerializer.compile', return_value=None):
+                regular = admin_client.get(WALLET_LIST_CREATE_URL, params)
+            assert compiled.status_code == status.HTTP_200_OK
+            assert compiled.content == regular.content
+        assert compiled_rows.call_count == 2
+
     def test_create_wallet_admin_for_other_user(self, admin_client, test_user_b, usd_currency):
         wallet_data = {"name": "User B Wallet by Admin", "currency": usd_currency.id, "user": test_user_b.id}
         response = admin_client.post(WALLET_LIST_CREATE_URL, data=wallet_data)
@@ -47,6 +167,27 @@ class TestWalletListCreateView:
         assert response.data['success'] is True
         assert "Wallet has been successfully created." in response.data['message']
 
+    def test_reads_after_write_stick_to_primary(self, admin_client, admin_user, test_user_b, usd_currency):
+        wallet_data = {"name": "Sticky Wallet", "currency": usd_currency.id, "user": test_user_b.id}
+        response = admin_client.post(WALLET_LIST_CREATE_URL, data=wallet_data)
+        assert response.status_code == status.HTTP_201_CREATED
+        assert settings.READ_YOUR_WRITES_COOKIE in response.cookies
+
+        # pinned by the cookie, then by the user's cache key once the cookie is gone
+        for _ in range(2):
+            with CaptureQueriesContext(connections['replica']) as replica_queries:
+                response = admin_client.get(WALLET_LIST_CREATE_URL)
+            assert response.status_code == status.HTTP_200_OK
+            assert len(replica_queries) == 0
+            assert settings.READ_YOUR_WRITES_COOKIE not in response.cookies
+            admin_client.cookies.clear()
+
+        cache.delete(ReadYourWrites.user_key(admin_user.pk))
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            response = admin_client.get(WALLET_LIST_CREATE_URL)
+        assert response.status_code == status.HTTP_200_OK
+        assert len(replica_queries) > 0
+
     def test_create_wallet_unauthenticated(self, client, usd_currency):
         wallet_data = {"name": "Unauth Wallet", "currency": usd_currency.id}
         response = client.post(WALLET_LIST_CREATE_URL, data=wallet_data)
@@ -92,6 +233,13 @@ class TestWalletRetrieveUpdateDestroyView:
         user_a_primary_usd_wallet.refresh_from_db()
         assert user_a_primary_usd_wallet.name == "Updated Name by User A"
 
+    def test_update_wallet_ignores_spend_counters(self, user_a_client, user_a_primary_usd_wallet):
+        spends_date = Wallet.objects.get(pk=user_a_primary_usd_wallet.pk).spends_date
+        url = wallet_detail_url(user_a_primary_usd_wallet.id)
+        response = user_a_client.patch(url, data={"spends_date": "2000-01-01", "withdrawn_today": "0.00"})
+        assert response.status_code == status.HTTP_200_OK
+        assert Wallet.objects.get(pk=user_a_primary_usd_wallet.pk).spends_date == spends_date
+
     def test_deactivate_wallet_owner(self, user_a_client, user_a_primary_usd_wallet):
         user_a_primary_usd_wallet.is_active = True
         user_a_primary_usd_wallet.save()
@@ -147,13 +295,102 @@ class TestTransactionListView:
         assert t1.id in transaction_ids
         assert t2.id in transaction_ids
 
+    def test_list_transactions_cursor_pagination(self, admin_client, sample_transactions):
+        t1, t2 = sample_transactions
+        response = admin_client.get(TRANSACTION_LIST_URL, {'pagination': 'cursor', 'page_size': 1})
+        assert response.status_code == status.HTTP_200_OK
+        assert 'count' not in response.data['data']
+        assert [t['id'] for t in response.data['data']['results']] == [t2.id]
+
+        response = admin_client.get(response.data['data']['next'])
+        assert [t['id'] for t in response.data['data']['results']] == [t1.id]
+
+    def test_cursor_pagination_breaks_ordering_ties_and_rejects_non_unique_fields(
+        self, admin_client, sample_transactions
+    ):
+        Transaction.objects.update(created_at=timezone.now())
+        ids = []
+        params = {'pagination': 'cursor', 'page_size': 1, 'ordering': 'created_at'}
+        response = admin_client.get(TRANSACTION_LIST_URL, params)
+        while True:
+            ids.extend(t['id'] for t in response.data['data']['results'])
+            if not response.data['data']['next']:
+                break
+            response = admin_client.get(response.data['data']['next'])
+        assert ids == sorted(t.id for t in sample_transactions)
+
+        response = admin_client.get(TRANSACTION_LIST_URL, {**params, 'ordering': '-amount'})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert admin_client.get(TRANSACTION_LIST_URL, {'ordering': '-amount'}).status_code == status.HTTP_200_OK
+
+    def test_compiled_transaction_list_matches_serializer_output(self, mocker, admin_client, sample_transactions):
+        compiled_rows = mocker.spy(CompiledListSerializer, 'to_representation')
+        t1, _ = sample_transactions
+        Transaction.objects.filter(pk=t1.pk).update(extra_info={'atm': 'A-1'}, expires_at=timezone.now())
+
+        for params in ({}, {'pagination': 'cursor', 'page_size': 1}):
+            compiled = admin_client.get(TRANSACTION_LIST_URL, params)
+            with patch('core.base.views.CompiledListSerializer.compile', return_value=None):
+                regular = admin_client.get(TRANSACTION_LIST_URL, params)
+            assert compiled.status_code == status.HTTP_200_OK
+            assert compiled.content == regular.content
+        assert compiled_rows.call_count == 2
+
+    def test_list_transactions_in_msgpack(self, admin_client, sample_transactions):
+        t1, t2 = sample_transactions
+        as_json = admin_client.get(TRANSACTION_LIST_URL)
+        as_rows = admin_client.get(TRANSACTION_LIST_URL, HTTP_ACCEPT='application/msgpack')
+        assert as_rows.status_code == status.HTTP_200_OK
+        assert as_rows['Content-Type'] == 'application/msgpack'
+        assert msgpack.unpackb(as_rows.content) == json.loads(as_json.content)
+
+        as_columns = admin_client.get(TRANSACTION_LIST_URL, HTTP_ACCEPT='application/msgpack; layout=columnar')
+        page = msgpack.unpackb(as_columns.content)['data']
+        assert page['count'] == 2
+        columns, rows = page['results']['columns'], page['results']['rows']
+        assert [dict(zip(columns, row)) for row in rows] == json.loads(as_json.content)['data']['results']
+        assert {row[columns.index('amount')] for row in rows} == {"50.00", "30.00"}
+        assert len(as_columns.content) < len(as_rows.content) < len(as_json.content)
+
+    def test_list_transactions_projects_requested_fields(self, admin_client, sample_transactions):
+        t1, t2 = sample_transactions
+        params = {'fields': 'id,amount,wallet.name,wallet.balance', 'expand': 'wallet'}
+        with CaptureQueriesContext(connections['replica']) as reads:
+            response = admin_client.get(TRANSACTION_LIST_URL, params)
+        assert response.status_code == status.HTTP_200_OK
+        results = {t['id']: t for t in response.data['data']['results']}
+        assert results[t1.id] == {
+            'id': t1.id,
+            'amount': "50.00",
+            'wallet': {'name': t1.wallet.name, 'balance': str(t1.wallet.balance)},
+        }
+        # the count and the page, no column is loaded lazily per row
+        assert len(reads) == 2
+
+    def test_export_transactions_streams_ndjson(self, user_a_client, sample_transactions):
+        t1, _ = sample_transactions
+        response = user_a_client.get(TRANSACTION_EXPORT_URL)
+        assert response.status_code == status.HTTP_200_OK
+        assert response['Content-Type'] == 'application/x-ndjson'
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        assert [(row['id'], row['amount'], row['reference']) for row in rows] == [(t1.id, "50.00", "TXNTESTA123")]
+
+    def test_export_transactions_streams_filtered_csv(self, admin_client, sample_transactions):
+        _, t2 = sample_transactions
+        response = admin_client.get(TRANSACTION_EXPORT_URL, {'export_format': 'csv', 'wallet': t2.wallet_id})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        assert lines[0].startswith('id,wallet,related_wallet,amount')
+        assert len(lines) == 2 and lines[1].startswith(f"{t2.id},{t2.wallet_id},,30.00,DEPOSIT")
+
+        assert admin_client.get(TRANSACTION_EXPORT_URL, {'export_format': 'xml'}).status_code == 400
+
     def test_list_transactions_unauthenticated(self, client):
         response = client.get(TRANSACTION_LIST_URL)
         assert response.status_code == status.HTTP_401_UNAUTHORIZED
 
 
 @pytest.mark.django_db(databases=['default', 'replica'], transaction=True)
-@patch('wallets.utils.send_sms_task')
+@patch('wallets.tasks.send_outbox_notifications')
 class TestRequestATMCodeView:
     def test_request_atm_code_success(self, mock_send_sms_task, user_a_client, test_user_a):
         initial_code_count = ATMCode.objects.filter(user=test_user_a).count()
@@ -162,10 +399,12 @@ class TestRequestATMCodeView:
         assert response.data['success'] is True
         assert ATMCode.objects.filter(user=test_user_a).count() == initial_code_count + 1
         new_code = ATMCode.objects.filter(user=test_user_a).latest('created_at')
-        mock_send_sms_task.delay.assert_called_once_with(
-            test_user_a.phone_number,
-            f"Your ATM code is {new_code.code}. Please keep it safe and do not share it with anyone.",
-        )
+        assert sent_sms(mock_send_sms_task) == [
+            (
+                test_user_a.phone_number,
+                f"Your ATM code is {new_code.code}. Please keep it safe and do not share it with anyone.",
+            )
+        ]
 
     def test_request_atm_code_unauthenticated(self, mock_send_sms_task, client):
         response = client.post(REQUEST_ATM_CODE_URL)
@@ -174,7 +413,7 @@ class TestRequestATMCodeView:
 
 
 @pytest.mark.django_db(databases=['default', 'replica'], transaction=True)
-@patch('wallets.utils.send_sms_task')
+@patch('wallets.tasks.send_outbox_notifications')
 class TestTransferMoneyView:
     def test_transfer_money_success(
         self,
@@ -214,7 +453,52 @@ class TestTransferMoneyView:
         assert response.data['success'] is True
         assert "Transfer initiated successfully" in response.data['message']
         assert 'reference' in response.data['data']
-        assert mock_send_sms_task.delay.call_count == 2
+        assert len(sent_sms(mock_send_sms_task)) == 2
+
+    def test_transfer_money_accepts_msgpack_body(
+        self, mock_send_sms_task, user_a_client, user_a_primary_usd_wallet, user_b_primary_usd_wallet
+    ):
+        transfer_data = {
+            "source_wallet": user_a_primary_usd_wallet.id,
+            "target_wallet": user_b_primary_usd_wallet.id,
+            "amount": "15.00",
+        }
+        response = user_a_client.post(
+            TRANSFER_MONEY_URL,
+            data=msgpack.packb(transfer_data),
+            content_type='application/msgpack',
+            HTTP_ACCEPT='application/msgpack',
+        )
+        assert response.status_code == status.HTTP_200_OK
+        body = msgpack.unpackb(response.content)
+        assert body['success'] is True
+        assert Transaction.objects.filter(reference=body['data']['reference']).exists()
+
+        response = user_a_client.post(TRANSFER_MONEY_URL, data=b'\xc1', content_type='application/msgpack')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_transfer_money_replays_idempotent_retry(
+        self, mock_send_sms_task, user_a_client, user_a_primary_usd_wallet, user_b_primary_usd_wallet
+    ):
+        transfer_data = {
+            "source_wallet": user_a_primary_usd_wallet.id,
+            "target_wallet": user_b_primary_usd_wallet.id,
+            "amount": "15.00",
+        }
+        key = uuid.uuid4().hex
+        first = user_a_client.post(TRANSFER_MONEY_URL, data=transfer_data, HTTP_IDEMPOTENCY_KEY=key)
+        retry = user_a_client.post(TRANSFER_MONEY_URL, data=transfer_data, HTTP_IDEMPOTENCY_KEY=key)
+
+        assert first.status_code == retry.status_code == status.HTTP_200_OK
+        assert retry.headers['Idempotent-Replayed'] == 'true'
+        assert retry.data['data']['reference'] == first.data['data']['reference']
+        assert Transaction.objects.filter(reference__startswith='WTRF').count() == 2
+        assert len(sent_sms(mock_send_sms_task)) == 2
+
+        changed = user_a_client.post(
+            TRANSFER_MONEY_URL, data={**transfer_data, "amount": "16.00"}, HTTP_IDEMPOTENCY_KEY=key
+        )
+        assert changed.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
 
     def test_transfer_money_insufficient_balance(
         self, mock_send_sms_task, user_a_client, user_a_primary_usd_wallet, user_b_primary_usd_wallet
@@ -270,7 +554,112 @@ class TestTransferMoneyView:
 
 
 @pytest.mark.django_db(databases=['default', 'replica'], transaction=True)
-@patch('wallets.utils.send_sms_task')
+@patch('wallets.tasks.send_outbox_notifications')
+class TestBulkTransferMoneyView:
+    def test_bulk_transfer_partial_success(
+        self,
+        mock_send_sms_task,
+        user_a_client,
+        user_a_primary_usd_wallet,
+        user_a_eur_wallet,
+        user_b_primary_usd_wallet,
+        user_b_secondary_usd_wallet,
+    ):
+        transfer_data = {
+            "transfers": [
+                {
+                    "source_wallet": user_a_primary_usd_wallet.id,
+                    "target_wallet": user_b_primary_usd_wallet.id,
+                    "amount": "10.00",
+                },
+                {
+                    "source_wallet": user_a_primary_usd_wallet.id,
+                    "target_wallet": user_b_secondary_usd_wallet.id,
+                    "amount": "20.00",
+                },
+                {
+                    "source_wallet": user_a_eur_wallet.id,
+                    "target_wallet": user_b_primary_usd_wallet.id,
+                    "amount": "5.00",
+                },
+                {
+                    "source_wallet": user_b_primary_usd_wallet.id,
+                    "target_wallet": user_a_primary_usd_wallet.id,
+                    "amount": "5.00",
+                },
+            ]
+        }
+        response = user_a_client.post(BULK_TRANSFER_MONEY_URL, data=transfer_data, format='json')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['success'] is False
+        results = response.data['data']['results']
+        assert [result['success'] for result in results] == [True, True, False, False]
+        assert "same currency" in results[2]['message']
+        assert "Invalid source or target wallet" in results[3]['message']
+        assert (
+            Transaction.objects.filter(reference=results[0]['reference'], status=Transaction.Status.PENDING).count()
+            == 2
+        )
+        assert Transaction.objects.filter(reference__startswith='WTRF').count() == 4
+        assert len(sent_sms(mock_send_sms_task)) == 4
+
+    def test_bulk_transfer_costs_fixed_queries_and_one_publish(
+        self, mock_send_sms_task, user_a_client, user_a_primary_usd_wallet, user_b_primary_usd_wallet
+    ):
+        def post(size):
+            transfer = {
+                "source_wallet": user_a_primary_usd_wallet.id,
+                "target_wallet": user_b_primary_usd_wallet.id,
+                "amount": "1.00",
+            }
+            mock_send_sms_task.reset_mock()
+            with CaptureQueriesContext(connections['default']) as writes:
+                with CaptureQueriesContext(connections['replica']) as reads:
+                    response = user_a_client.post(
+                        BULK_TRANSFER_MONEY_URL, data={"transfers": [transfer] * size}, format='json'
+                    )
+            assert response.data['success'] is True
+            assert mock_send_sms_task.delay.call_count == 1
+            assert len(sent_sms(mock_send_sms_task)) == 2 * size
+            return len(writes) + len(reads)
+
+        # the first batch of the day seeds the wallet's transactions counter
+        post(1)
+        assert post(3) == post(30) == 10
+
+    def test_bulk_transfer_counts_daily_transactions_for_the_batch(
+        self,
+        mock_send_sms_task,
+        user_a_client,
+        default_tier,
+        usd_currency,
+        user_a_primary_usd_wallet,
+        user_b_primary_usd_wallet,
+    ):
+        TierCurrencyLimit.objects.filter(tier=default_tier, currency=usd_currency).update(daily_transactions_limit=2)
+        TierLimitCache.invalidate(default_tier.id, [usd_currency.id])
+        transfer = {
+            "source_wallet": user_a_primary_usd_wallet.id,
+            "target_wallet": user_b_primary_usd_wallet.id,
+            "amount": "1.00",
+        }
+        response = user_a_client.post(BULK_TRANSFER_MONEY_URL, data={"transfers": [transfer] * 3}, format='json')
+
+        results = response.data['data']['results']
+        assert [result['success'] for result in results] == [True, True, False]
+        assert "Transactions limit exceeded" in results[2]['message']
+        assert Transaction.objects.filter(reference__startswith='WTRF').count() == 4
+        assert DailyTransactionCounter.acquire_many(user_a_primary_usd_wallet, 2, 1) == 0
+
+    def test_bulk_transfer_rejects_empty_batch(self, mock_send_sms_task, user_a_client):
+        response = user_a_client.post(BULK_TRANSFER_MONEY_URL, data={"transfers": []}, format='json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        mock_send_sms_task.delay.assert_not_called()
+
+
+@pytest.mark.django_db(databases=['default', 'replica'], transaction=True)
+@patch('wallets.tasks.send_outbox_notifications')
 class TestTransferActionView:
     @pytest.fixture
     def pending_transfer_ref(
@@ -320,14 +709,14 @@ class TestTransferActionView:
         response = user_b_client.post(TRANSFER_ACTION_URL, data=action_data)
         assert response.status_code == status.HTTP_200_OK
         assert "Transfer has been successfully Processed" in response.data['message']
-        assert mock_send_sms_task.delay.call_count == 2
+        assert len(sent_sms(mock_send_sms_task)) == 2
 
     def test_transfer_action_decline_success(self, mock_send_sms_task, user_b_client, pending_transfer_ref):
         action_data = {"reference": pending_transfer_ref, "action": "decline"}
         response = user_b_client.post(TRANSFER_ACTION_URL, data=action_data)
         assert response.status_code == status.HTTP_200_OK
         assert "Transfer has been successfully Declined" in response.data['message']
-        assert mock_send_sms_task.delay.call_count == 2
+        assert len(sent_sms(mock_send_sms_task)) == 2
 
     def test_transfer_action_finalize_raises_value_error(self, mock_send_sms_task, user_a_client):
         action_data = {"reference": "NONEXISTENTREF", "action": "accept"}
@@ -338,7 +727,7 @@ class TestTransferActionView:
 
 
 @pytest.mark.django_db(databases=['default', 'replica'], transaction=True)
-@patch('wallets.utils.send_sms_task')
+@patch('wallets.tasks.send_outbox_notifications')
 class TestCancelTransferView:
     @pytest.fixture
     def pending_cancellable_ref(self, user_a_primary_usd_wallet, user_b_primary_usd_wallet):
@@ -368,7 +757,18 @@ class TestCancelTransferView:
         response = user_a_client.post(CANCEL_TRANSFER_URL, data=cancel_data)
         assert response.status_code == status.HTTP_200_OK
         assert "Transfer has been successfully canceled" in response.data['message']
-        assert mock_send_sms_task.delay.call_count == 2
+        assert len(sent_sms(mock_send_sms_task)) == 2
+
+    def test_cancel_transfer_rejects_overdue_transfer(self, mock_send_sms_task, user_a_client, pending_cancellable_ref):
+        Transaction.objects.filter(reference=pending_cancellable_ref).update(
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        response = user_a_client.post(CANCEL_TRANSFER_URL, data={"reference": pending_cancellable_ref})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        mock_send_sms_task.delay.assert_not_called()
+        assert set(Transaction.objects.filter(reference=pending_cancellable_ref).values_list('status', flat=True)) == {
+            Transaction.Status.PENDING
+        }
 
     def test_cancel_transfer_raises_value_error(self, mock_send_sms_task, user_a_client):
         cancel_data = {"reference": "NONEXISTENTREF"}
@@ -379,7 +779,7 @@ class TestCancelTransferView:
 
 
 @pytest.mark.django_db(databases=['default', 'replica'], transaction=True)
-@patch('wallets.utils.send_sms_task')
+@patch('wallets.tasks.send_outbox_notifications')
 class TestBankWebhook:
     def test_bank_webhook_valid_signature_success_event(
         self, mock_send_sms_task_global, client, user_a_primary_usd_wallet
@@ -392,7 +792,7 @@ class TestBankWebhook:
 
         assert response.status_code == status.HTTP_200_OK
         assert response.data['success'] == True
-        mock_send_sms_task_global.delay.assert_called_once()
+        assert len(sent_sms(mock_send_sms_task_global)) == 1
 
     def test_bank_webhook_valid_signature_failed_event(self, mock_send_sms_task_global, client):
 
@@ -404,6 +804,186 @@ class TestBankWebhook:
         assert response.status_code == status.HTTP_400_BAD_REQUEST
         mock_send_sms_task_global.delay.assert_not_called()
 
+    def test_bank_webhook_retry_is_not_applied_twice(self, mock_send_sms_task, client, user_a_primary_usd_wallet):
+        event_data = {"type": "deposit", "wallet_id": user_a_primary_usd_wallet.id, "amount": "40.00"}
+        headers = {'HTTP_X_WEBHOOK_TOKEN': 'supersecrettoken', 'HTTP_IDEMPOTENCY_KEY': uuid.uuid4().hex}
+        for _ in range(2):
+            response = client.post(BANK_WEBHOOK_URL, data=event_data, content_type='application/json', **headers)
+            assert response.status_code == status.HTTP_200_OK
+
+        user_a_primary_usd_wallet.refresh_from_db()
+        assert user_a_primary_usd_wallet.balance == Decimal("540.00")
+        assert len(sent_sms(mock_send_sms_task)) == 1
+
+    @patch('wallets.views.process_bank_events')
+    def test_bank_webhook_async_mode_acknowledges_and_drains_in_order(
+        self, mock_process_bank_events, mock_send_sms_task, client, settings, user_a_primary_usd_wallet
+    ):
+        settings.BANK_WEBHOOK_ASYNC = True
+        events = [
+            {"type": "deposit", "wallet_id": user_a_primary_usd_wallet.id, "amount": "100.00"},
+            {"type": "deposit", "wallet_id": user_a_primary_usd_wallet.id, "amount": "-5.00"},
+            {"type": "deposit", "wallet_id": user_a_primary_usd_wallet.id, "amount": "50.00"},
+        ]
+        for event_data in events:
+            response = client.post(
+                BANK_WEBHOOK_URL,
+                data=event_data,
+                content_type='application/json',
+                HTTP_X_WEBHOOK_TOKEN='supersecrettoken',
+            )
+            assert response.status_code == status.HTTP_202_ACCEPTED
+        assert mock_process_bank_events.delay.call_count == 3
+        user_a_primary_usd_wallet.refresh_from_db()
+        assert user_a_primary_usd_wallet.balance == Decimal("500.00")
+
+        assert BankEventInbox.drain(batch_size=1, max_batches=5) == 3
+
+        user_a_primary_usd_wallet.refresh_from_db()
+        assert user_a_primary_usd_wallet.balance == Decimal("650.00")
+        assert list(BankEvent.objects.order_by('id').values_list('status', flat=True)) == [
+            BankEvent.Status.PROCESSED,
+            BankEvent.Status.FAILED,
+            BankEvent.Status.PROCESSED,
+        ]
+        assert BankEventInbox.drain(batch_size=1, max_batches=5) == 0
+
+    @patch('wallets.views.process_bank_events')
+    def test_bank_webhook_async_mode_applies_withdrawals_synchronously(
+        self, mock_process_bank_events, mock_send_sms_task, client, settings, user_a_primary_usd_wallet
+    ):
+        settings.BANK_WEBHOOK_ASYNC = True
+        headers = {'content_type': 'application/json', 'HTTP_X_WEBHOOK_TOKEN': 'supersecrettoken'}
+
+        response = client.post(
+            BANK_WEBHOOK_URL,
+            data={"type": "withdrawal", "wallet_id": user_a_primary_usd_wallet.id, "amount": "550.00"},
+            **headers,
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['success'] is False
+
+        response = client.post(
+            BANK_WEBHOOK_URL,
+            data=[{"type": "withdrawal", "wallet_id": user_a_primary_usd_wallet.id, "amount": "30.00"}],
+            **headers,
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert [result['success'] for result in response.data['data']['results']] == [True]
+        assert 'event_id' not in response.data['data']['results'][0]
+
+        user_a_primary_usd_wallet.refresh_from_db()
+        assert user_a_primary_usd_wallet.balance == Decimal("470.00")
+        assert not BankEvent.objects.exists()
+        mock_process_bank_events.delay.assert_not_called()
+        assert len(sent_sms(mock_send_sms_task)) == 1
+
+    def test_bank_event_drain_skips_claimed_events_and_keeps_wallet_order(
+        self, mock_send_sms_task, settings, user_a_primary_usd_wallet, user_b_primary_usd_wallet
+    ):
+        settings.BANK_WEBHOOK_ASYNC = True
+        a_first, b_deposit, a_second = BankEventInbox.enqueue_many(
+            [
+                {"type": "deposit", "wallet_id": user_a_primary_usd_wallet.id, "amount": "100.00"},
+                {"type": "deposit", "wallet_id": user_b_primary_usd_wallet.id, "amount": "20.00"},
+                {"type": "withdrawal", "wallet_id": user_a_primary_usd_wallet.id, "amount": "550.00"},
+            ]
+        )
+        claimed, release = threading.Event(), threading.Event()
+
+        def other_worker():
+            # holds a_first the way a concurrent drain would
+            with atomic():
+                BankEvent.objects.select_for_update().get(pk=a_first.pk)
+                claimed.set()
+                release.wait(timeout=10)
+            connections.close_all()
+
+        worker = threading.Thread(target=other_worker)
+        worker.start()
+        claimed.wait(timeout=10)
+        try:
+            assert BankEventInbox.drain(batch_size=10, max_batches=5) == 1
+        finally:
+            release.set()
+            worker.join()
+
+        statuses = dict(BankEvent.objects.values_list('id', 'status'))
+        assert statuses == {
+            a_first.id: BankEvent.Status.PENDING,
+            b_deposit.id: BankEvent.Status.PROCESSED,
+            a_second.id: BankEvent.Status.PENDING,
+        }
+        assert BankEventInbox.drain(batch_size=10, max_batches=5) == 2
+        user_a_primary_usd_wallet.refresh_from_db()
+        assert user_a_primary_usd_wallet.balance == Decimal("50.00")
+
+    def test_bank_webhook_batch_applies_events_in_order_with_per_event_results(
+        self, mock_send_sms_task, client, user_a_primary_usd_wallet, user_b_primary_usd_wallet
+    ):
+        events = [
+            {"type": "deposit", "wallet_id": user_a_primary_usd_wallet.id, "amount": "100.00"},
+            {"type": "deposit", "wallet_id": user_b_primary_usd_wallet.id, "amount": "20.00"},
+            {"type": "withdrawal", "wallet_id": user_a_primary_usd_wallet.id, "amount": "550.00"},
+            {"type": "deposit", "wallet_id": user_a_primary_usd_wallet.id, "amount": "-5.00"},
+            {"type": "withdrawal", "wallet_id": 999999, "amount": "10.00"},
+            {"type": "withdrawal", "wallet_id": user_b_primary_usd_wallet.id, "amount": "900.00"},
+            {"type": "unknown_event"},
+        ]
+        response = client.post(
+            BANK_WEBHOOK_URL, data=events, content_type='application/json', HTTP_X_WEBHOOK_TOKEN='supersecrettoken'
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['success'] is False
+        assert [result['success'] for result in response.data['data']['results']] == [
+            True,
+            True,
+            True,
+            False,
+            False,
+            False,
+            False,
+        ]
+        assert response.data['data']['results'][5]['message'] == "Insufficient balance"
+        user_a_primary_usd_wallet.refresh_from_db()
+        user_b_primary_usd_wallet.refresh_from_db()
+        assert user_a_primary_usd_wallet.balance == Decimal("50.00")
+        assert user_b_primary_usd_wallet.balance == Decimal("720.00")
+        assert Transaction.objects.filter(money_source=Transaction.MoneySource.ATM).count() == 3
+        assert len(sent_sms(mock_send_sms_task)) == 3
+
+    def test_bank_webhook_batch_logs_unexpected_errors(
+        self, mock_send_sms_task, caplog, client, user_a_primary_usd_wallet
+    ):
+        events = [{"type": "deposit", "wallet_id": user_a_primary_usd_wallet.id, "amount": "100.00"}] * 2
+        with patch('wallets.events.TransactionOperator.apply_atm_events', side_effect=RuntimeError("boom")):
+            with caplog.at_level(logging.ERROR, logger='bank_events'):
+                response = client.post(
+                    BANK_WEBHOOK_URL,
+                    data=events,
+                    content_type='application/json',
+                    HTTP_X_WEBHOOK_TOKEN='supersecrettoken',
+                )
+
+        assert [result['success'] for result in response.data['data']['results']] == [False, False]
+        assert [record.exc_info[1].args for record in caplog.records] == [("boom",)]
+
+    def test_bank_webhook_atm_login_claims_code_once(self, mock_send_sms_task, client, test_user_a):
+        atm_code = ATMCode.objects.create(user=test_user_a)
+        event_data = {"type": "login", "phone_number": test_user_a.phone_number, "pass_code": atm_code.code}
+
+        with CaptureQueriesContext(connections['default']) as queries:
+            assert ATMCode.claim(test_user_a.phone_number, atm_code.code) is True
+        assert len(queries) == 1
+        response = client.post(
+            BANK_WEBHOOK_URL, data=event_data, content_type='application/json', HTTP_X_WEBHOOK_TOKEN='supersecrettoken'
+        )
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['message'] == 'Invalid ATM Code'
+        assert ATMCode.objects.get(pk=atm_code.pk).is_used is True
+
     def test_bank_webhook_invalid_signature(self, mock_send_sms_task_global, client):
         event_data = {"type": "test", "data": {}}
         response = client.post(
@@ -433,4 +1013,4 @@ class TestBankWebhook:
         user_a_primary_usd_wallet.refresh_from_db()
         assert user_a_primary_usd_wallet.balance == initial_balance + deposit_amount
 
-        mock_send_sms_task_in_utils.delay.assert_called_once()
+        assert len(sent_sms(mock_send_sms_task_in_utils)) == 1
@@ -0,0 +1,168 @@
+from datetime import timedelta
+from decimal import Decimal
+
+import pytest
+from django.utils import timezone
+
+from wallets.ledger import DailyLimitExceeded, InsufficientBalance, WalletLedger
+from wallets.models import BalanceCheckpoint, LedgerEntry, Transaction, Wallet
+from wallets.utils import TransactionOperator
+
+
+@pytest.mark.django_db(databases=['default', 'replica'], transaction=True)
+class TestWalletLedger:
+    def test_debit_updates_balance_and_counter(self, user_a_primary_usd_wallet):
+        WalletLedger.debit(user_a_primary_usd_wallet, Decimal("120.00"), 'withdrawn_today', Decimal("1000.00"))
+
+        assert user_a_primary_usd_wallet.balance == Decimal("380.00")
+        assert user_a_primary_usd_wallet.withdrawn_today == Decimal("120.00")
+        stored = Wallet.objects.get(pk=user_a_primary_usd_wallet.pk)
+        assert stored.balance == Decimal("380.00")
+        assert stored.withdrawn_today == Decimal("120.00")
+        assert stored.transferred_today == Decimal("0.00")
+
+    def test_debit_insufficient_balance_leaves_wallet_untouched(self, user_a_primary_usd_wallet):
+        with pytest.raises(InsufficientBalance):
+            WalletLedger.debit(user_a_primary_usd_wallet, Decimal("600.00"), 'withdrawn_today', Decimal("1000.00"))
+
+        stored = Wallet.objects.get(pk=user_a_primary_usd_wallet.pk)
+        assert stored.balance == Decimal("500.00")
+        assert stored.withdrawn_today == Decimal("0.00")
+
+    def test_debit_over_daily_limit(self, user_a_primary_usd_wallet):
+        with pytest.raises(DailyLimitExceeded, match="Transfer limit exceeded"):
+            WalletLedger.debit(user_a_primary_usd_wallet, Decimal("200.00"), 'transferred_today', Decimal("100.00"))
+
+        assert Wallet.objects.get(pk=user_a_primary_usd_wallet.pk).balance == Decimal("500.00")
+
+    def test_debit_rolls_yesterdays_counters_over(self, user_a_primary_usd_wallet):
+        Wallet.objects.filter(pk=user_a_primary_usd_wallet.pk).update(
+            transferred_today=Decimal("100.00"),
+            withdrawn_today=Decimal("50.00"),
+            spends_date=timezone.localdate() - timedelta(days=1),
+        )
+        user_a_primary_usd_wallet.refresh_from_db()
+        assert user_a_primary_usd_wallet.spent_today('transferred_today') == Decimal("0.00")
+
+        WalletLedger.debit(user_a_primary_usd_wallet, Decimal("80.00"), 'transferred_today', Decimal("100.00"))
+
+        stored = Wallet.objects.get(pk=user_a_primary_usd_wallet.pk)
+        assert stored.transferred_today == Decimal("80.00")
+        assert stored.withdrawn_today == Decimal("0.00")
+        assert stored.spends_date == timezone.localdate()
+
+    def test_credit_does_not_touch_daily_counters(self, user_b_primary_usd_wallet):
+        WalletLedger.credit(user_b_primary_usd_wallet, Decimal("30.00"))
+
+        stored = Wallet.objects.get(pk=user_b_primary_usd_wallet.pk)
+        assert stored.balance == Decimal("730.00")
+        assert stored.transferred_today == Decimal("0.00")
+
+
+@pytest.mark.django_db(databases=['default', 'replica'], transaction=True)
+def test_accepted_transfer_moves_funds_and_completes_both_legs(
+    mocker, test_user_a, test_user_b, user_a_primary_usd_wallet, user_b_primary_usd_wallet
+):
+    mocker.patch('wallets.tasks.send_outbox_notifications')
+    test_user_a.save()
+    reference = TransactionOperator.initiate_wallet_to_wallet_transfer(
+        user_a_primary_usd_wallet, user_b_primary_usd_wallet, Decimal("40.00"), ''
+    )
+
+    TransactionOperator.finalize_transfer(reference, 'accept', test_user_b)
+
+    assert Wallet.objects.get(pk=user_a_primary_usd_wallet.pk).balance == Decimal("460.00")
+    assert Wallet.objects.get(pk=user_b_primary_usd_wallet.pk).balance == Decimal("740.00")
+    assert set(Transaction.objects.filter(reference=reference).values_list('status', flat=True)) == {
+        Transaction.Status.COMPLETED
+    }
+
+
+@pytest.mark.django_db(databases=['default', 'replica'], transaction=True)
+class TestShardedWallet:
+    def test_credits_land_on_shards_and_count_towards_balance(self, user_b_primary_usd_wallet):
+        WalletLedger.enable_sharding(user_b_primary_usd_wallet, 4)
+
+        for i in range(8):
+            WalletLedger.credit(user_b_primary_usd_wallet, Decimal("10.00"), key=f"REF-{i}")
+
+        wallet = Wallet.objects.get(pk=user_b_primary_usd_wallet.pk)
+        assert wallet.balance == Decimal("700.00")
+        assert wallet.shards.count() == 4
+        assert wallet.total_balance() == Decimal("780.00")
+
+    def test_debit_compacts_shards_when_main_balance_is_short(self, user_b_primary_usd_wallet):
+        WalletLedger.enable_sharding(user_b_primary_usd_wallet, 2)
+        WalletLedger.credit(user_b_primary_usd_wallet, Decimal("100.00"), key="REF-A")
+
+        WalletLedger.debit(user_b_primary_usd_wallet, Decimal("750.00"), 'transferred_today', Decimal("5000.00"))
+
+        wallet = Wallet.objects.get(pk=user_b_primary_usd_wallet.pk)
+        assert wallet.balance == Decimal("50.00")
+        assert wallet.total_balance() == Decimal("50.00")
+
+    def test_disabling_sharding_folds_shards_back(self, user_b_primary_usd_wallet):
+        WalletLedger.enable_sharding(user_b_primary_usd_wallet, 3)
+        WalletLedger.credit(user_b_primary_usd_wallet, Decimal("25.00"), key="REF-B")
+
+        WalletLedger.enable_sharding(user_b_primary_usd_wallet, 0)
+
+        wallet = Wallet.objects.get(pk=user_b_primary_usd_wallet.pk)
+        assert wallet.balance == Decimal("725.00")
+        assert not wallet.shards.exists()
+
+
+@pytest.mark.django_db(databases=['default', 'replica'], transaction=True)
+class TestDoubleEntryLedger:
+    def test_movements_post_balanced_legs(self, user_a_primary_usd_wallet):
+        deposit = TransactionOperator.atm_deposit(user_a_primary_usd_wallet, Decimal("80.00"))
+        TransactionOperator.atm_withdrawal(user_a_primary_usd_wallet, Decimal("30.00"))
+
+        entries = LedgerEntry.objects.filter(reference=deposit.reference)
+        assert {(e.account, e.direction) for e in entries} == {
+            (LedgerEntry.Account.ATM, LedgerEntry.Direction.DEBIT),
+            (LedgerEntry.Account.WALLET, LedgerEntry.Direction.CREDIT),
+        }
+        assert WalletLedger.ledger_balance(user_a_primary_usd_wallet) == Decimal("550.00")
+        assert Wallet.objects.get(pk=user_a_primary_usd_wallet.pk).balance == Decimal("550.00")
+
+    def test_checkpoint_and_historical_balance(self, user_a_primary_usd_wallet):
+        TransactionOperator.atm_deposit(user_a_primary_usd_wallet, Decimal("100.00"))
+        checkpoints = WalletLedger.checkpoint_balances(settle=timedelta(0))
+        before_second_deposit = timezone.now()
+        TransactionOperator.atm_deposit(user_a_primary_usd_wallet, Decimal("40.00"))
+
+        assert [(c.wallet_id, c.balance) for c in checkpoints] == [(user_a_primary_usd_wallet.id, Decimal("600.00"))]
+        assert BalanceCheckpoint.objects.filter(wallet=user_a_primary_usd_wallet).count() == 2
+        assert WalletLedger.ledger_balance(user_a_primary_usd_wallet) == Decimal("640.00")
+        assert WalletLedger.ledger_balance(user_a_primary_usd_wallet, at=before_second_deposit) == Decimal("600.00")
+        assert WalletLedger.checkpoint_balances(settle=timedelta(hours=1)) == []
+
+
+@pytest.mark.django_db(databases=['default', 'replica'], transaction=True)
+def test_overdue_pending_transfers_expire_in_batches(
+    mocker, test_user_b, user_a_primary_usd_wallet, user_b_primary_usd_wallet
+):
+    sms = mocker.patch('wallets.tasks.send_outbox_notifications')
+    overdue = [
+        TransactionOperator.initiate_wallet_to_wallet_transfer(
+            user_a_primary_usd_wallet, user_b_primary_usd_wallet, Decimal("10.00"), ''
+        )
+        for _ in range(3)
+    ]
+    fresh = TransactionOperator.initiate_wallet_to_wallet_transfer(
+        user_a_primary_usd_wallet, user_b_primary_usd_wallet, Decimal("10.00"), ''
+    )
+    Transaction.objects.filter(reference__in=overdue).update(expires_at=timezone.now() - timedelta(minutes=1))
+
+    assert TransactionOperator.expire_pending_transfers(batch_size=2) == 2
+    assert TransactionOperator.expire_pending_transfers(batch_size=2) == 1
+    assert TransactionOperator.expire_pending_transfers(batch_size=2) == 0
+
+    assert set(Transaction.objects.filter(reference__in=overdue).values_list('status', flat=True)) == {
+        Transaction.Status.EXPIRED
+    }
+    assert Transaction.objects.filter(reference=fresh, status=Transaction.Status.PENDING).count() == 2
+    assert sum(len(call.args[0]) for call in sms.delay.call_args_list) == 6
+    with pytest.raises(ValueError, match="No pending transaction"):
+        TransactionOperator.finalize_transfer(overdue[0], 'accept', test_user_b)
@@ -0,0 +1,58 @@
+from decimal import Decimal
+
+import pytest
+from django.core.cache import cache
+from django.db import connections
+from django.db.transaction import atomic
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from wallets.ledger import InsufficientBalance
+from wallets.limits import (
+    DailyTransactionCounter,
+    TierLimitCache,
+    TransactionsLimitExceeded,
+)
+from wallets.models import TierCurrencyLimit, Wallet
+from wallets.utils import TransactionOperator
+
+
+@pytest.mark.django_db(databases=['default', 'replica'], transaction=True)
+def test_tier_limit_cache_serves_hits_without_queries_and_invalidates_on_save(default_tier, usd_currency):
+    first = TierLimitCache.get(default_tier.id, usd_currency.id)
+    with CaptureQueriesContext(connections['default']) as default_queries:
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            assert (
+                TierLimitCache.get(default_tier.id, usd_currency.id).daily_transfer_limit == first.daily_transfer_limit
+            )
+    assert len(default_queries) == len(replica_queries) == 0
+
+    limit = TierCurrencyLimit.objects.get(tier=default_tier, currency=usd_currency)
+    limit.daily_transfer_limit = Decimal("123.00")
+    with atomic():
+        limit.save()
+        # nothing is dropped before the commit, a miss here would cache the old row again
+        assert TierLimitCache.get(default_tier.id, usd_currency.id).daily_transfer_limit == first.daily_transfer_limit
+
+    assert TierLimitCache.get(default_tier.id, usd_currency.id).daily_transfer_limit == Decimal("123.00")
+
+
+@pytest.mark.django_db(databases=['default', 'replica'], transaction=True)
+def test_daily_transactions_limit_counts_in_cache_and_rebuilds_from_db(
+    default_tier, usd_currency, user_a_primary_usd_wallet
+):
+    TierCurrencyLimit.objects.filter(tier=default_tier, currency=usd_currency).update(daily_transactions_limit=2)
+    TierLimitCache.invalidate(default_tier.id, [usd_currency.id])
+    wallet = Wallet.objects.select_related('user', 'currency').get(pk=user_a_primary_usd_wallet.pk)
+
+    TransactionOperator.atm_withdrawal(wallet, Decimal("10.00"))
+    with pytest.raises(InsufficientBalance):
+        TransactionOperator.atm_withdrawal(wallet, Decimal("900.00"))
+    TransactionOperator.bank_transfer_out(wallet, Decimal("10.00"))
+    with pytest.raises(TransactionsLimitExceeded):
+        TransactionOperator.atm_withdrawal(wallet, Decimal("10.00"))
+
+    cache.delete(DailyTransactionCounter.cache_key(wallet.pk, timezone.localdate()))
+    with pytest.raises(TransactionsLimitExceeded):
+        TransactionOperator.atm_withdrawal(wallet, Decimal("10.00"))
+    assert Wallet.objects.get(pk=wallet.pk).balance == Decimal("480.00")
@@ -0,0 +1,110 @@
+from datetime import timedelta
+from decimal import Decimal
+
+import pytest
+from django.conf import settings
+from django.db import connections
+from django.db.transaction import atomic
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from utils.sms import FakeSmsProvider
+from wallets.models import NotificationOutbox, Wallet
+from wallets.tasks import send_outbox_notifications
+from wallets.utils import NotificationOperator, NotificationOutboxRelay
+
+
+@pytest.mark.django_db(databases=['default', 'replica'], transaction=True)
+def test_notifications_of_rolled_back_postings_are_never_sent(mocker, user_a_primary_usd_wallet):
+    sms = mocker.patch('wallets.tasks.send_outbox_notifications')
+
+    with pytest.raises(RuntimeError):
+        with atomic():
+            NotificationOperator.send_atm_code(user_a_primary_usd_wallet.user.phone_number, '123456')
+            sms.delay.assert_not_called()
+            raise RuntimeError
+    NotificationOperator.send_atm_code(user_a_primary_usd_wallet.user.phone_number, '654321')
+
+    sms.delay.assert_called_once()
+    assert NotificationOutbox.objects.get().published_at is not None
+    assert NotificationOutboxRelay.relay(settle=timedelta(0)) == 0
+
+
+@pytest.mark.django_db(databases=['default', 'replica'], transaction=True)
+def test_outbox_messages_are_sent_once_and_failed_ones_published_again(mocker):
+    publish = mocker.patch('wallets.tasks.send_outbox_notifications')
+    FakeSmsProvider.outbox.clear()
+
+    def send(provider, phone_number, message):
+        if phone_number == "+201000000002":
+            raise ConnectionError("provider unavailable")
+        FakeSmsProvider.outbox.append((phone_number, message))
+
+    mocker.patch.object(FakeSmsProvider, 'send', send)
+    NotificationOutboxRelay.enqueue([("+201000000001", "first"), ("+201000000002", "second")])
+    ids = publish.delay.call_args.args[0]
+
+    assert NotificationOutboxRelay.deliver(ids) == [ids[1]]
+    # the same batch published twice
+    assert NotificationOutboxRelay.deliver(ids) == [ids[1]]
+    assert FakeSmsProvider.outbox == [("+201000000001", "first")]
+
+    assert NotificationOutboxRelay.relay(settle=timedelta(0)) == 0
+    NotificationOutbox.objects.filter(id=ids[1]).update(
+        published_at=timezone.now() - timedelta(seconds=settings.NOTIFICATION_OUTBOX_REDELIVER_AFTER + 1)
+    )
+    assert NotificationOutboxRelay.relay(settle=timedelta(0)) == 1
+    assert publish.delay.call_args.args[0] == [ids[1]]
+
+
+@pytest.mark.django_db(databases=['default', 'replica'], transaction=True)
+def test_outbox_task_retries_only_the_messages_that_failed(mocker):
+    publish = mocker.patch.object(send_outbox_notifications, 'delay')
+    FakeSmsProvider.outbox.clear()
+    failures = {"+201000000002": 1}
+
+    def flaky_send(provider, phone_number, message):
+        if failures.get(phone_number):
+            failures[phone_number] -= 1
+            raise ConnectionError("provider unavailable")
+        FakeSmsProvider.outbox.append((phone_number, message))
+
+    mocker.patch.object(FakeSmsProvider, 'send', flaky_send)
+    NotificationOutboxRelay.enqueue([("+201000000001", "first"), ("+201000000002", "second")])
+    send_outbox_notifications.apply(args=[publish.call_args.args[0]])
+
+    assert FakeSmsProvider.outbox == [("+201000000001", "first"), ("+201000000002", "second")]
+    assert not NotificationOutbox.objects.filter(sent_at__isnull=True).exists()
+
+    failures["+201000000003"] = settings.SMS_MAX_RETRIES + 1
+    NotificationOutboxRelay.enqueue([("+201000000003", "third")])
+    assert send_outbox_notifications.apply(args=[publish.call_args.args[0]]).failed()
+    assert NotificationOutbox.objects.get(phone_number="+201000000003").sent_at is None
+
+
+@pytest.mark.django_db(databases=['default', 'replica'], transaction=True)
+def test_transfer_notification_loads_its_context_in_one_query(
+    mocker, test_user_a, test_user_b, user_a_primary_usd_wallet, user_b_primary_usd_wallet
+):
+    sms = mocker.patch('wallets.tasks.send_outbox_notifications')
+    source = Wallet.objects.get(pk=user_a_primary_usd_wallet.pk)
+    target = Wallet.objects.get(pk=user_b_primary_usd_wallet.pk)
+
+    with CaptureQueriesContext(connections['replica']) as reads:
+        NotificationOperator.send_transfer_accepted_notification(source, target, Decimal("5.00"), "REF-1")
+
+    assert len(reads) == 1
+    currency = user_a_primary_usd_wallet.currency
+    published = NotificationOutbox.objects.filter(id__in=sms.delay.call_args.args[0])
+    assert [(outbox_message.phone_number, outbox_message.message) for outbox_message in published] == [
+        (
+            test_user_a.phone_number,
+            f"Hi {test_user_a.first_name}, your transfer of {currency} 5.00 to {test_user_b.first_name} "
+            f"{test_user_b.last_name} ({test_user_b.phone_number}) has been accepted. The transaction reference is REF-1.",
+        ),
+        (
+            test_user_b.phone_number,
+            f"Hi {test_user_b.first_name}, you've accepted a transfer of {currency} 5.00 from {test_user_a.first_name} "
+            f"{test_user_a.last_name} ({test_user_a.phone_number}). The transaction reference is REF-1.",
+        ),
+    ]
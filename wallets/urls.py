@@ -2,8 +2,10 @@ from django.urls import path
 
 from .views import (
     BankWebhook,
+    BulkTransferMoneyView,
     CancelTransferView,
     RequestATMCodeView,
+    TransactionExportView,
     TransactionListView,
     TransferActionView,
     TransferMoneyView,
@@ -16,8 +18,10 @@ urlpatterns = [
     path('<int:pk>/', WalletRetrieveUpdateDestroyView.as_view(), name='wallet-detail'),
     path('bank-webhook/', BankWebhook.as_view(), name='bank-webhook'),
     path('transfer-money/', TransferMoneyView.as_view(), name='transfer-money'),
+    path('bulk-transfer-money/', BulkTransferMoneyView.as_view(), name='bulk-transfer-money'),
     path('transfer-action/', TransferActionView.as_view(), name='transfer-action'),
     path('cancel-transfer/', CancelTransferView.as_view(), name='cancel-transfer'),
     path('request-atm-code/', RequestATMCodeView.as_view(), name='request-atm-code'),
     path('transactions/', TransactionListView.as_view(), name='transaction-list'),
+    path('transactions/export/', TransactionExportView.as_view(), name='transaction-export'),
 ]
@@ -1,34 +1,49 @@
+from collections import Counter
+from datetime import timedelta
 from decimal import Decimal
 
 from decouple import config
-from django.db.transaction import atomic
+from django.conf import settings
+from django.db.models import Q
+from django.db.transaction import atomic, on_commit
+from django.utils import timezone
 
 from authentication.models import User
-from utils.common_tasks import send_sms_task
 from utils.data_generators import generate_reference
+from utils.sms import get_sms_provider
 
-from .models import Transaction, Wallet
+from .ledger import DailyLimitExceeded, WalletLedger
+from .limits import DailyTransactionCounter, TierLimitCache
+from .models import (
+    LedgerEntry,
+    NotificationOutbox,
+    TierCurrencyLimit,
+    Transaction,
+    Wallet,
+)
 
 
 class TransactionOperator:
     @staticmethod
-    def initiate_wallet_to_wallet_transfer(source: Wallet, target: Wallet, amount: int, description: str) -> str:
-        with atomic():
+    def get_currency_limit(wallet: Wallet) -> TierCurrencyLimit:
+        return TierLimitCache.get(wallet.user.tier_id, wallet.currency_id)
 
-            # check if source wallet didn't exceed the limit
-            transferred_today = source.transferred_today
-            daily_transfer_limit = (
-                source.user.tier.currency_limits.filter(currency=source.currency).first().daily_transfer_limit
+    @staticmethod
+    def initiate_wallet_to_wallet_transfer(source: Wallet, target: Wallet, amount: int, description: str) -> str:
+        # check if source wallet didn't exceed the limit
+        transferred_today = source.spent_today('transferred_today')
+        currency_limit = TransactionOperator.get_currency_limit(source)
+        daily_transfer_limit = currency_limit.daily_transfer_limit
+
+        if transferred_today + amount > daily_transfer_limit:
+            raise ValueError(
+                f"Transfer limit exceeded. You can only transfer {daily_transfer_limit - transferred_today} {source.currency.currency_code} today."
             )
 
-            if transferred_today + amount > daily_transfer_limit:
-                raise ValueError(
-                    f"Transfer limit exceeded. You can only transfer {daily_transfer_limit - transferred_today} {source.currency.currency_code} today."
-                )
-
+        with DailyTransactionCounter.reserve(source, currency_limit.daily_transactions_limit), atomic():
             reference = generate_reference(prefix="WTRF")
 
-            source_transaction = Transaction.objects.create(
+            Transaction.objects.create(
                 wallet=source,
                 related_wallet=target,
                 amount=amount,
@@ -38,8 +53,7 @@ class TransactionOperator:
                 description=description,
                 reference=reference,
             )
-            source_transaction.save()
-            target_transaction = Transaction.objects.create(
+            Transaction.objects.create(
                 wallet=target,
                 related_wallet=source,
                 amount=amount,
@@ -49,112 +63,208 @@ class TransactionOperator:
                 description=description,
                 reference=reference,
             )
-            target_transaction.save()
             return reference
 
+    @staticmethod
+    def initiate_bulk_wallet_to_wallet_transfers(transfers: list) -> list:
+        """
+        Initiate every transfer of a validated bulk request with a single insert and notify both
+        sides of all of them with one outbox write. Transfers that already carry an ``error`` are
+        skipped, the others get a ``reference`` or an ``error``. Each source wallet's daily
+        transactions are counted with one cache round-trip for the whole batch.
+        """
+        limits = {}
+        candidates = {}
+        for transfer in transfers:
+            if transfer['error']:
+                continue
+            source, amount = transfer['source_wallet'], transfer['amount']
+
+            limit_key = (source.user.tier_id, source.currency_id)
+            if limit_key not in limits:
+                limits[limit_key] = TransactionOperator.get_currency_limit(source)
+            daily_transfer_limit = limits[limit_key].daily_transfer_limit
+            transferred_today = source.spent_today('transferred_today')
+            if transferred_today + amount > daily_transfer_limit:
+                transfer['error'] = (
+                    f"Transfer limit exceeded. You can only transfer {daily_transfer_limit - transferred_today} {source.currency.currency_code} today."
+                )
+                continue
+            candidates.setdefault(source.pk, []).append(transfer)
+
+        counted = []
+        for source_transfers in candidates.values():
+            source = source_transfers[0]['source_wallet']
+            daily_transactions_limit = limits[(source.user.tier_id, source.currency_id)].daily_transactions_limit
+            granted = DailyTransactionCounter.acquire_many(source, daily_transactions_limit, len(source_transfers))
+            if granted:
+                counted.append((source, granted))
+            for transfer in source_transfers[granted:]:
+                transfer['error'] = str(DailyTransactionCounter.limit_exceeded(daily_transactions_limit))
+        accepted = [transfer for transfer in transfers if not transfer['error']]
+
+        expires_at = timezone.now() + Transaction.PENDING_TTL
+        rows = []
+        for transfer in accepted:
+            source, target, amount = transfer['source_wallet'], transfer['target_wallet'], transfer['amount']
+            transfer['reference'] = generate_reference(prefix="WTRF")
+            for wallet, related_wallet, transaction_type in (
+                (source, target, Transaction.TransactionType.TRANSFER_OUT),
+                (target, source, Transaction.TransactionType.TRANSFER_IN),
+            ):
+                rows.append(
+                    Transaction(
+                        wallet=wallet,
+                        related_wallet=related_wallet,
+                        amount=amount,
+                        status=Transaction.Status.PENDING,
+                        transaction_type=transaction_type,
+                        money_source=Transaction.MoneySource.WALLET_TO_WALLET,
+                        description=transfer['description'],
+                        reference=transfer['reference'],
+                        expires_at=expires_at,
+                    )
+                )
+
+        try:
+            with atomic():
+                Transaction.objects.bulk_create(rows, batch_size=1000)
+                NotificationOperator.send_transfer_notifications(
+                    [
+                        (
+                            transfer['source_wallet'],
+                            transfer['target_wallet'],
+                            transfer['amount'],
+                            transfer['reference'],
+                        )
+                        for transfer in accepted
+                    ]
+                )
+        except BaseException:
+            for wallet, granted in counted:
+                DailyTransactionCounter.release(wallet, granted)
+            raise
+        return transfers
+
     @staticmethod
     def finalize_transfer(reference: str, action: str, actor: User) -> None:
+        limit_error = None
         with atomic():
-            transaction = Transaction.objects.filter(
-                reference=reference,
-                status=Transaction.Status.PENDING,
-                transaction_type=Transaction.TransactionType.TRANSFER_OUT,
-                related_wallet__user=actor,
-            ).first()
-            if not transaction:
-                raise ValueError("No pending transaction found with the provided reference.")
-            amount = transaction.amount
-            source = transaction.wallet
-            target = transaction.related_wallet
-            transferred_today = source.transferred_today
-            daily_transfer_limit = (
-                source.user.tier.currency_limits.filter(currency=source.currency).first().daily_transfer_limit
-            )
-
-            if transferred_today + amount > daily_transfer_limit:
-                Transaction.objects.filter(
+            # lock the pending transfer so two concurrent accepts can't both post it
+            transaction = (
+                Transaction.objects.select_for_update(of=('self',))
+                .select_related('wallet__user', 'wallet__currency', 'related_wallet__user')
+                .filter(
                     reference=reference,
                     status=Transaction.Status.PENDING,
                     transaction_type=Transaction.TransactionType.TRANSFER_OUT,
-                    wallet=source,
-                    related_wallet=target,
-                ).update(status=(Transaction.Status.COMPLETED if action == 'ACCEPT' else Transaction.Status.FAILED))
-                Transaction.objects.filter(
-                    reference=reference,
-                    status=Transaction.Status.PENDING,
-                    transaction_type=Transaction.TransactionType.TRANSFER_IN,
-                    wallet=target,
-                    related_wallet=source,
-                ).update(status=(Transaction.Status.COMPLETED if action == 'ACCEPT' else Transaction.Status.FAILED))
-                NotificationOperator.send_transfer_failed_notification(source, target, amount, reference)
-                raise ValueError(
-                    f"Transfer limit exceeded. You can only transfer {daily_transfer_limit - transferred_today} {source.currency} today."
+                    related_wallet__user=actor,
+                    expires_at__gt=timezone.now(),
                 )
-
+                .first()
+            )
             if not transaction:
-                raise ValueError("No pending transactions found with the provided reference.")
-
+                raise ValueError("No pending transaction found with the provided reference.")
+            amount = transaction.amount
             source = transaction.wallet
             target = transaction.related_wallet
+
             if action == 'accept':
-                if source.balance < transaction.amount:
-                    raise ValueError("Insufficient balance in source wallet.")
-
-                source.balance -= transaction.amount
-                source.transferred_today += transaction.amount
-                target.balance += transaction.amount
-                source.save()
-                target.save()
-                NotificationOperator.send_transfer_accepted_notification(source, target, amount, reference)
+                daily_transfer_limit = TransactionOperator.get_currency_limit(source).daily_transfer_limit
+                try:
+                    WalletLedger.debit(source, amount, 'transferred_today', daily_transfer_limit)
+                except DailyLimitExceeded as e:
+                    limit_error = e
+                    new_status = Transaction.Status.FAILED
+                    NotificationOperator.send_transfer_failed_notification(source, target, amount, reference)
+                else:
+                    WalletLedger.credit(target, amount, key=reference)
+                    WalletLedger.record(LedgerEntry.legs(reference, amount, source, target, transaction))
+                    new_status = Transaction.Status.COMPLETED
+                    NotificationOperator.send_transfer_accepted_notification(source, target, amount, reference)
             else:
+                new_status = Transaction.Status.DECLINED
                 NotificationOperator.send_transfer_declined_notification(source, target, amount, reference)
+
             # Update the status of both transactions
             Transaction.objects.filter(
                 reference=reference,
                 status=Transaction.Status.PENDING,
-                transaction_type=Transaction.TransactionType.TRANSFER_OUT,
-                wallet=source,
-                related_wallet=target,
-            ).update(status=(Transaction.Status.COMPLETED if action == 'ACCEPT' else Transaction.Status.DECLINED))
-            Transaction.objects.filter(
-                reference=reference,
-                status=Transaction.Status.PENDING,
-                transaction_type=Transaction.TransactionType.TRANSFER_IN,
-                wallet=target,
-                related_wallet=source,
-            ).update(status=(Transaction.Status.COMPLETED if action == 'ACCEPT' else Transaction.Status.DECLINED))
+                transaction_type__in=[
+                    Transaction.TransactionType.TRANSFER_OUT,
+                    Transaction.TransactionType.TRANSFER_IN,
+                ],
+                wallet__in=[source, target],
+            ).update(status=new_status)
+
+        if limit_error:
+            raise limit_error
 
     @staticmethod
     def cancel_transfer(reference: str, actor: User) -> None:
         with atomic():
-            transaction = Transaction.objects.filter(
-                reference=reference,
-                status=Transaction.Status.PENDING,
-                transaction_type=Transaction.TransactionType.TRANSFER_OUT,
-                wallet__user=actor,
-            ).first()
+            # lock the pending transfer the way finalize_transfer does, so an expiry or an accept
+            # that committed first makes this cancel fail instead of notifying about nothing
+            transaction = (
+                Transaction.objects.select_for_update(of=('self',))
+                .select_related('wallet__user', 'wallet__currency', 'related_wallet__user')
+                .filter(
+                    reference=reference,
+                    status=Transaction.Status.PENDING,
+                    transaction_type=Transaction.TransactionType.TRANSFER_OUT,
+                    wallet__user=actor,
+                    expires_at__gt=timezone.now(),
+                )
+                .first()
+            )
             if not transaction:
                 raise ValueError("No pending transactions found with the provided reference.")
             source = transaction.wallet
             target = transaction.related_wallet
 
-            NotificationOperator.send_transfer_canceled_notification(
-                transaction.wallet, transaction.related_wallet, transaction.amount, reference
-            )
-            Transaction.objects.filter(
+            canceled = Transaction.objects.filter(
                 reference=reference,
                 status=Transaction.Status.PENDING,
-                transaction_type=Transaction.TransactionType.TRANSFER_OUT,
-                wallet=source,
-                related_wallet=target,
-            ).update(status=(Transaction.Status.CANCELED))
+                transaction_type__in=[
+                    Transaction.TransactionType.TRANSFER_OUT,
+                    Transaction.TransactionType.TRANSFER_IN,
+                ],
+                wallet__in=[source, target],
+            ).update(status=Transaction.Status.CANCELED)
+            if not canceled:
+                raise ValueError("No pending transactions found with the provided reference.")
+            NotificationOperator.send_transfer_canceled_notification(source, target, transaction.amount, reference)
+
+    @staticmethod
+    def expire_pending_transfers(batch_size: int) -> int:
+        """
+        Move one batch of overdue pending transfers to EXPIRED and notify both sides, returns the number
+        of transfers expired. Transfers locked by a concurrent accept or cancel are left for the next batch.
+        """
+        with atomic():
+            overdue = list(
+                Transaction.objects.select_for_update(skip_locked=True)
+                .filter(
+                    status=Transaction.Status.PENDING,
+                    expires_at__lte=timezone.now(),
+                    transaction_type=Transaction.TransactionType.TRANSFER_OUT,
+                )
+                .order_by('expires_at')[:batch_size]
+            )
+            if not overdue:
+                return 0
+
             Transaction.objects.filter(
-                reference=reference,
+                reference__in=[transaction.reference for transaction in overdue],
                 status=Transaction.Status.PENDING,
-                transaction_type=Transaction.TransactionType.TRANSFER_IN,
-                wallet=target,
-                related_wallet=source,
-            ).update(status=(Transaction.Status.CANCELED))
+                transaction_type__in=[
+                    Transaction.TransactionType.TRANSFER_OUT,
+                    Transaction.TransactionType.TRANSFER_IN,
+                ],
+            ).update(status=Transaction.Status.EXPIRED, updated_at=timezone.now())
+            NotificationOperator.send_transfers_expired_notification(overdue)
+
+        return len(overdue)
 
     @staticmethod
     def atm_deposit(target: Wallet, amount: Decimal) -> Transaction:
@@ -166,24 +276,18 @@ class TransactionOperator:
                 transaction_type=Transaction.TransactionType.DEPOSIT,
                 money_source=Transaction.MoneySource.ATM,
             )
-            target.balance += amount
-            target.save()
+            WalletLedger.credit(target, amount, key=transaction.reference)
+            WalletLedger.record(
+                LedgerEntry.legs(transaction.reference, amount, LedgerEntry.Account.ATM, target, transaction)
+            )
 
         return transaction
 
     @staticmethod
     def atm_withdrawal(source: Wallet, amount: Decimal) -> Transaction:
-        with atomic():
-            daily_withdrawal_limit = (
-                source.user.tier.currency_limits.filter(currency=source.currency).first().daily_withdrawal_limit
-            )
-            if source.withdrawn_today + amount > daily_withdrawal_limit:
-                raise ValueError(
-                    f"Withdrawal limit exceeded. You can only withdraw {daily_withdrawal_limit - source.withdrawn_today} {source.currency} today."
-                )
-
-            if source.balance < amount:
-                raise ValueError("Insufficient balance")
+        currency_limit = TransactionOperator.get_currency_limit(source)
+        with DailyTransactionCounter.reserve(source, currency_limit.daily_transactions_limit), atomic():
+            WalletLedger.debit(source, amount, 'withdrawn_today', currency_limit.daily_withdrawal_limit)
 
             transaction = Transaction.objects.create(
                 wallet=source,
@@ -192,25 +296,87 @@ class TransactionOperator:
                 transaction_type=Transaction.TransactionType.WITHDRAWAL,
                 money_source=Transaction.MoneySource.ATM,
             )
-
-            source.balance -= amount
-            source.withdrawn_today += transaction.amount
-            source.save()
+            WalletLedger.record(
+                LedgerEntry.legs(transaction.reference, amount, source, LedgerEntry.Account.ATM, transaction)
+            )
 
         return transaction
 
     @staticmethod
-    def bank_transfer_out(source: Wallet, amount: Decimal):
-        with atomic():
-            daily_transfer_limit = (
-                source.user.tier.currency_limits.filter(currency=source.currency).first().daily_transfer_limit
-            )
-            if source.transferred_today + amount > daily_transfer_limit:
-                raise ValueError(
-                    f"Transfer limit exceeded. You can only transfer {daily_transfer_limit - source.transferred_today} {source.currency} today."
+    def apply_atm_events(events: list) -> list:
+        """
+        Apply a chunk of ATM ``(event_type, wallet, amount)`` deposits and withdrawals in one database
+        transaction and return the created transaction, or the error, of every event. Runs of deposits
+        are credited together and flushed before a withdrawal from the same wallet, so each wallet still
+        sees its events in order.
+        """
+        outcomes, credits, counted = [], {}, []
+        expires_at = timezone.now() + Transaction.PENDING_TTL
+
+        def flush_credits():
+            WalletLedger.credit_many(credits.values())
+            credits.clear()
+
+        try:
+            with atomic():
+                for event_type, wallet, amount in events:
+                    if event_type == 'deposit':
+                        transaction_type = Transaction.TransactionType.DEPOSIT
+                        credited = credits.get(wallet.pk, (wallet, Decimal('0.00')))[1]
+                        credits[wallet.pk] = (wallet, credited + amount)
+                    else:
+                        transaction_type = Transaction.TransactionType.WITHDRAWAL
+                        if wallet.pk in credits:
+                            flush_credits()
+                        currency_limit = TransactionOperator.get_currency_limit(wallet)
+                        try:
+                            with DailyTransactionCounter.reserve(wallet, currency_limit.daily_transactions_limit):
+                                WalletLedger.debit(
+                                    wallet, amount, 'withdrawn_today', currency_limit.daily_withdrawal_limit
+                                )
+                        except ValueError as e:
+                            outcomes.append(e)
+                            continue
+                        counted.append(wallet)
+
+                    outcomes.append(
+                        Transaction(
+                            wallet=wallet,
+                            amount=amount,
+                            status=Transaction.Status.COMPLETED,
+                            transaction_type=transaction_type,
+                            money_source=Transaction.MoneySource.ATM,
+                            reference=generate_reference(prefix='TXN'),
+                            expires_at=expires_at,
+                        )
+                    )
+                flush_credits()
+
+                transactions = Transaction.objects.bulk_create(
+                    [outcome for outcome in outcomes if isinstance(outcome, Transaction)]
+                )
+                WalletLedger.record(
+                    *(
+                        (
+                            LedgerEntry.legs(t.reference, t.amount, LedgerEntry.Account.ATM, t.wallet, t)
+                            if t.transaction_type == Transaction.TransactionType.DEPOSIT
+                            else LedgerEntry.legs(t.reference, t.amount, t.wallet, LedgerEntry.Account.ATM, t)
+                        )
+                        for t in transactions
+                    )
                 )
-            if source.balance < amount:
-                raise ValueError("Insufficient Balance")
+        except BaseException:
+            for wallet in counted:
+                DailyTransactionCounter.release(wallet)
+            raise
+
+        return outcomes
+
+    @staticmethod
+    def bank_transfer_out(source: Wallet, amount: Decimal):
+        currency_limit = TransactionOperator.get_currency_limit(source)
+        with DailyTransactionCounter.reserve(source, currency_limit.daily_transactions_limit), atomic():
+            WalletLedger.debit(source, amount, 'transferred_today', currency_limit.daily_transfer_limit)
 
             transaction = Transaction.objects.create(
                 wallet=source,
@@ -219,83 +385,280 @@ class TransactionOperator:
                 transaction_type=Transaction.TransactionType.TRANSFER_OUT,
                 money_source=Transaction.MoneySource.BANK_TRANSFER,
             )
-
-            source.balance -= amount
-            source.transferred_today += transaction.amount
-            source.save()
+            WalletLedger.record(
+                LedgerEntry.legs(transaction.reference, amount, source, LedgerEntry.Account.BANK, transaction)
+            )
 
         return transaction
 
 
-class NotificationOperator:
+class NotificationOutboxRelay:
+    """
+    Notifications are stored in ``NotificationOutbox`` inside the caller's database transaction and
+    handed to the SMS task after it commits, so a rolled back posting sends nothing and no broker
+    round-trip happens while row locks are held.
+
+    Delivery is at least once: the task gets outbox ids and only sends the messages still unsent, so
+    a batch published twice is sent once, and messages whose task never marked them sent are
+    published again after ``NOTIFICATION_OUTBOX_REDELIVER_AFTER`` seconds. A worker dying between
+    the provider call and its commit can still send a message twice.
+    """
+
     @staticmethod
-    def send_transfer_notification(source: Wallet, target: Wallet, amount: int, reference: str) -> None:
-        sender_message = f"""
-        Hi {target.user.first_name}, you have initiated a transfer of {source.currency} {amount} to {target.user.first_name} {target.user.last_name} ({target.user.phone_number}). 
+    def enqueue(messages: list) -> None:
+        rows = NotificationOutbox.objects.bulk_create(
+            [NotificationOutbox(phone_number=phone_number, message=message) for phone_number, message in messages]
+        )
+        ids = [row.id for row in rows]
+        on_commit(lambda: NotificationOutboxRelay.relay(ids=ids))
+
+    @staticmethod
+    def relay(ids: list = None, batch_size: int = 500, settle: timedelta = timedelta(seconds=30)) -> int:
+        """
+        Publish the unpublished messages in ``ids``, or without ``ids`` the oldest ``batch_size``
+        messages older than ``settle`` that were never published or were published but not sent,
+        and return how many were published. Messages locked by another relay are skipped.
+        """
+        # tasks imports this module
+        from .tasks import send_outbox_notifications
+
+        now = timezone.now()
+        with atomic():
+            pending = NotificationOutbox.objects.select_for_update(skip_locked=True).filter(sent_at__isnull=True)
+            if ids is not None:
+                pending = pending.filter(id__in=ids, published_at__isnull=True)
+            else:
+                redeliver_before = now - timedelta(seconds=settings.NOTIFICATION_OUTBOX_REDELIVER_AFTER)
+                pending = pending.filter(
+                    Q(published_at__isnull=True) | Q(published_at__lt=redeliver_before), created_at__lt=now - settle
+                )
+            pending_ids = list(pending.order_by('id').values_list('id', flat=True)[:batch_size])
+            if pending_ids:
+                NotificationOutbox.objects.filter(id__in=pending_ids).update(published_at=now)
+                on_commit(lambda: send_outbox_notifications.delay(pending_ids))
+        return len(pending_ids)
+
+    @staticmethod
+    def deliver(ids: list) -> list:
+        """
+        Send the messages in ``ids`` not sent yet, mark them sent and return the ids of those the
+        provider didn't accept. Messages another delivery is sending are skipped.
+        """
+        with atomic():
+            rows = list(
+                NotificationOutbox.objects.select_for_update(skip_locked=True)
+                .filter(id__in=ids, sent_at__isnull=True)
+                .order_by('id')
+            )
+            failed = Counter(get_sms_provider().send_many([(row.phone_number, row.message) for row in rows]))
+            sent, undelivered = [], []
+            for row in rows:
+                # identical messages to the same number are interchangeable
+                if failed[(row.phone_number, row.message)]:
+                    failed[(row.phone_number, row.message)] -= 1
+                    undelivered.append(row.id)
+                else:
+                    sent.append(row.id)
+            NotificationOutbox.objects.filter(id__in=sent).update(sent_at=timezone.now())
+        return undelivered
+
+
+class NotificationContext:
+    """
+    Names, phone numbers and currency of the wallets a notification mentions, keyed by wallet id.
+    Wallets loaded with their user and currency are read as they are, the others (wallets or bare
+    wallet ids) are resolved together by one joined ``values()`` query instead of lazy-loading each
+    relation.
+    """
+
+    VALUES = (
+        'id',
+        'name',
+        'user__first_name',
+        'user__last_name',
+        'user__phone_number',
+        'currency__currency_name',
+        'currency__symbol',
+    )
+
+    @staticmethod
+    def _entry(name, first_name, last_name, phone_number, currency_name, symbol) -> dict:
+        return {
+            'name': name,
+            'first_name': first_name,
+            'last_name': last_name,
+            'phone_number': phone_number,
+            # same text as str(Currency)
+            'currency': f"{currency_name} ({symbol})",
+        }
+
+    @classmethod
+    def build(cls, wallets) -> dict:
+        context, missing = {}, set()
+        for wallet in wallets:
+            if not isinstance(wallet, Wallet):
+                missing.add(wallet)
+            elif Wallet.user.is_cached(wallet) and Wallet.currency.is_cached(wallet):
+                user, currency = wallet.user, wallet.currency
+                context[wallet.pk] = cls._entry(
+                    wallet.name,
+                    user.first_name,
+                    user.last_name,
+                    user.phone_number,
+                    currency.currency_name,
+                    currency.symbol,
+                )
+            else:
+                missing.add(wallet.pk)
+
+        if missing:
+            for row in Wallet.objects.filter(id__in=missing).values(*cls.VALUES):
+                context[row['id']] = cls._entry(*(row[field] for field in cls.VALUES[1:]))
+        return context
+
+
+class NotificationOperator:
+    TRANSFER_INITIATED = (
+        """
+        Hi {target[first_name]}, you have initiated a transfer of {source[currency]} {amount} to {target[first_name]} {target[last_name]} ({target[phone_number]}). 
         The transaction reference is {reference}.
-        Waiting for Receiver to accept the transfer from your wallet {source.name}"""
+        Waiting for Receiver to accept the transfer from your wallet {source[name]}""".format,
+        "Hi {source[first_name]}, you have a pending transfer of {source[currency]} {amount} from {source[first_name]} {source[last_name]} ({source[phone_number]}). You can accept the transfer through the app.".format,
+    )
+    TRANSFER_ACCEPTED = (
+        "Hi {source[first_name]}, your transfer of {source[currency]} {amount} to {target[first_name]} {target[last_name]} ({target[phone_number]}) has been accepted. The transaction reference is {reference}.".format,
+        "Hi {target[first_name]}, you've accepted a transfer of {source[currency]} {amount} from {source[first_name]} {source[last_name]} ({source[phone_number]}). The transaction reference is {reference}.".format,
+    )
+    TRANSFER_DECLINED = (
+        "Hi {source[first_name]}, your transfer of {source[currency]} {amount} to {target[first_name]} {target[last_name]} ({target[phone_number]}) has been declined. The transaction reference is {reference}.".format,
+        "Hi {target[first_name]}, you've declined a transfer of {source[currency]} {amount} from {source[first_name]} {source[last_name]} ({source[phone_number]}). The transaction reference is {reference}.".format,
+    )
+    TRANSFER_CANCELED = (
+        "Hi {source[first_name]}, your transfer of {source[currency]} {amount} to {target[first_name]} {target[last_name]} ({target[phone_number]}) has been canceled. The transaction reference is {reference}.".format,
+        "Hi {target[first_name]}, a transfer of {source[currency]} {amount} from {source[first_name]} {source[last_name]} ({source[phone_number]}) has been canceled. The transaction reference is {reference}.".format,
+    )
+    TRANSFER_FAILED = (
+        "Hi {source[first_name]}, your transfer of {source[currency]} {amount} to {target[first_name]} {target[last_name]} ({target[phone_number]}) has failed. The transaction reference is {reference}.".format,
+        "Hi {target[first_name]}, a transfer of {source[currency]} {amount} from {source[first_name]} {source[last_name]} ({source[phone_number]}) has failed. The transaction reference is {reference}.".format,
+    )
+    TRANSFER_EXPIRED = (
+        "Hi {source[first_name]}, your transfer of {source[currency]} {amount} to {target[first_name]} {target[last_name]} ({target[phone_number]}) has expired. The transaction reference is {reference}.".format,
+        "Hi {target[first_name]}, a transfer of {source[currency]} {amount} from {source[first_name]} {source[last_name]} ({source[phone_number]}) has expired. The transaction reference is {reference}.".format,
+    )
+    ATM_CODE = "Your ATM code is {code}. Please keep it safe and do not share it with anyone.".format
+    WITHDRAWAL = "You've successfully withdrawed {wallet[currency]} {amount} from your wallet {wallet[name]}. transaction reference {reference}".format
+    DEPOSIT = "You've successfully deposited {wallet[currency]} {amount} to your wallet {wallet[name]}. transaction reference {reference}".format
+    BANK_TRANSFER_IN = "You've received {wallet[currency]} {amount} to your wallet {wallet[name]} from bank transfer. transaction reference {reference}".format
+    BANK_TRANSFER_OUT = "You've sent {wallet[currency]} {amount} from your wallet {wallet[name]} through bank transfer. transaction reference {reference}".format
 
-        receiver_message = f"Hi {source.user.first_name}, you have a pending transfer of {source.currency} {amount} from {source.user.first_name} {source.user.last_name} ({source.user.phone_number}). You can accept the transfer through the app."
+    @staticmethod
+    def _transfer_messages(templates, source: dict, target: dict, amount, reference: str) -> list:
+        sender_template, receiver_template = templates
+        return [
+            (source['phone_number'], sender_template(source=source, target=target, amount=amount, reference=reference)),
+            (
+                target['phone_number'],
+                receiver_template(source=source, target=target, amount=amount, reference=reference),
+            ),
+        ]
 
-        send_sms_task.delay(source.user.phone_number, sender_message)
-        send_sms_task.delay(target.user.phone_number, receiver_message)
+    @staticmethod
+    def _send_transfer(templates, source: Wallet, target: Wallet, amount, reference: str) -> None:
+        context = NotificationContext.build([source, target])
+        NotificationOutboxRelay.enqueue(
+            NotificationOperator._transfer_messages(
+                templates, context[source.pk], context[target.pk], amount, reference
+            )
+        )
 
     @staticmethod
-    def send_transfer_accepted_notification(source: Wallet, target: Wallet, amount: int, reference: str) -> None:
-        sender_message = f"Hi {source.user.first_name}, your transfer of {source.currency} {amount} to {target.user.first_name} {target.user.last_name} ({target.user.phone_number}) has been accepted. The transaction reference is {reference}."
-        receiver_message = f"Hi {target.user.first_name}, you've accepted a transfer of {source.currency} {amount} from {source.user.first_name} {source.user.last_name} ({source.user.phone_number}). The transaction reference is {reference}."
+    def _send_wallet_message(template, transaction: Transaction) -> None:
+        wallet = transaction.wallet if Transaction.wallet.is_cached(transaction) else transaction.wallet_id
+        wallet = NotificationContext.build([wallet])[transaction.wallet_id]
+        NotificationOutboxRelay.enqueue(
+            [
+                (
+                    wallet['phone_number'],
+                    template(wallet=wallet, amount=transaction.amount, reference=transaction.reference),
+                )
+            ]
+        )
 
-        send_sms_task.delay(source.user.phone_number, sender_message)
-        send_sms_task.delay(target.user.phone_number, receiver_message)
+    @staticmethod
+    def send_transfer_notification(source: Wallet, target: Wallet, amount: int, reference: str) -> None:
+        NotificationOperator._send_transfer(NotificationOperator.TRANSFER_INITIATED, source, target, amount, reference)
 
     @staticmethod
-    def send_transfer_declined_notification(source: Wallet, target: Wallet, amount: int, reference: str) -> None:
-        sender_message = f"Hi {source.user.first_name}, your transfer of {source.currency} {amount} to {target.user.first_name} {target.user.last_name} ({target.user.phone_number}) has been declined. The transaction reference is {reference}."
-        receiver_message = f"Hi {target.user.first_name}, you've declined a transfer of {source.currency} {amount} from {source.user.first_name} {source.user.last_name} ({source.user.phone_number}). The transaction reference is {reference}."
+    def send_transfer_accepted_notification(source: Wallet, target: Wallet, amount: int, reference: str) -> None:
+        NotificationOperator._send_transfer(NotificationOperator.TRANSFER_ACCEPTED, source, target, amount, reference)
 
-        send_sms_task.delay(source.user.phone_number, sender_message)
-        send_sms_task.delay(target.user.phone_number, receiver_message)
+    @staticmethod
+    def send_transfer_declined_notification(source: Wallet, target: Wallet, amount: int, reference: str) -> None:
+        NotificationOperator._send_transfer(NotificationOperator.TRANSFER_DECLINED, source, target, amount, reference)
 
     @staticmethod
     def send_transfer_canceled_notification(source: Wallet, target: Wallet, amount: int, reference: str) -> None:
-        sender_message = f"Hi {source.user.first_name}, your transfer of {source.currency} {amount} to {target.user.first_name} {target.user.last_name} ({target.user.phone_number}) has been canceled. The transaction reference is {reference}."
-        receiver_message = f"Hi {target.user.first_name}, a transfer of {source.currency} {amount} from {source.user.first_name} {source.user.last_name} ({source.user.phone_number}) has been canceled. The transaction reference is {reference}."
-        send_sms_task.delay(source.user.phone_number, sender_message)
-        send_sms_task.delay(target.user.phone_number, receiver_message)
+        NotificationOperator._send_transfer(NotificationOperator.TRANSFER_CANCELED, source, target, amount, reference)
 
     @staticmethod
     def send_transfer_failed_notification(source: Wallet, target: Wallet, amount: int, reference: str) -> None:
-        sender_message = f"Hi {source.user.first_name}, your transfer of {source.currency} {amount} to {target.user.first_name} {target.user.last_name} ({target.user.phone_number}) has failed. The transaction reference is {reference}."
-        receiver_message = f"Hi {target.user.first_name}, a transfer of {source.currency} {amount} from {source.user.first_name} {source.user.last_name} ({source.user.phone_number}) has failed. The transaction reference is {reference}."
+        NotificationOperator._send_transfer(NotificationOperator.TRANSFER_FAILED, source, target, amount, reference)
 
-        send_sms_task.delay(source.user.phone_number, sender_message)
-        send_sms_task.delay(target.user.phone_number, receiver_message)
+    @staticmethod
+    def _send_transfers(templates, transfers: list) -> None:
+        """
+        Notify both sides of every ``(source, target, amount, reference)`` transfer, wallets or
+        wallet ids, with one context query and one outbox write.
+        """
+        if not transfers:
+            return
+        context = NotificationContext.build(
+            [wallet for source, target, _, _ in transfers for wallet in (source, target)]
+        )
+        messages = []
+        for source, target, amount, reference in transfers:
+            source_id = source.pk if isinstance(source, Wallet) else source
+            target_id = target.pk if isinstance(target, Wallet) else target
+            messages.extend(
+                NotificationOperator._transfer_messages(
+                    templates, context[source_id], context[target_id], amount, reference
+                )
+            )
+        NotificationOutboxRelay.enqueue(messages)
 
     @staticmethod
-    def send_atm_code(phone_number, code):
-        send_sms_task.delay(
-            phone_number, f"Your ATM code is {code}. Please keep it safe and do not share it with anyone."
+    def send_transfer_notifications(transfers: list) -> None:
+        NotificationOperator._send_transfers(NotificationOperator.TRANSFER_INITIATED, transfers)
+
+    @staticmethod
+    def send_transfers_expired_notification(transactions: list) -> None:
+        NotificationOperator._send_transfers(
+            NotificationOperator.TRANSFER_EXPIRED,
+            [
+                (transaction.wallet_id, transaction.related_wallet_id, transaction.amount, transaction.reference)
+                for transaction in transactions
+            ],
         )
 
+    @staticmethod
+    def send_atm_code(phone_number, code):
+        NotificationOutboxRelay.enqueue([(phone_number, NotificationOperator.ATM_CODE(code=code))])
+
     @staticmethod
     def send_withdrawal_notification(transaction: Transaction):
-        message = f"You've successfully withdrawed {transaction.wallet.currency} {transaction.amount} from your wallet {transaction.wallet.name}. transaction reference {transaction.reference}"
-        send_sms_task.delay(transaction.wallet.user.phone_number, message)
+        NotificationOperator._send_wallet_message(NotificationOperator.WITHDRAWAL, transaction)
 
     @staticmethod
     def send_deposit_notification(transaction: Transaction):
-        message = f"You've successfully deposited {transaction.wallet.currency} {transaction.amount} to your wallet {transaction.wallet.name}. transaction reference {transaction.reference}"
-        send_sms_task.delay(transaction.wallet.user.phone_number, message)
+        NotificationOperator._send_wallet_message(NotificationOperator.DEPOSIT, transaction)
 
     @staticmethod
     def send_bank_transfer_in_notification(transaction: Transaction):
-        message = f"You've received {transaction.wallet.currency} {transaction.amount} to your wallet {transaction.wallet.name} from bank transfer. transaction reference {transaction.reference}"
-        send_sms_task.delay(transaction.wallet.user.phone_number, message)
+        NotificationOperator._send_wallet_message(NotificationOperator.BANK_TRANSFER_IN, transaction)
 
     @staticmethod
     def send_bank_transfer_out_notification(transaction: Transaction):
-        message = f"You've sent {transaction.wallet.currency} {transaction.amount} from your wallet {transaction.wallet.name} through bank transfer. transaction reference {transaction.reference}"
-        send_sms_task.delay(transaction.wallet.user.phone_number, message)
+        NotificationOperator._send_wallet_message(NotificationOperator.BANK_TRANSFER_OUT, transaction)
 
 
 def verify_webhook_signature(request):
@@ -1,30 +1,40 @@
+from django.conf import settings
+from django.db import transaction
+from django.http import StreamingHttpResponse
 from django.utils.translation import gettext_lazy as _
 from drf_spectacular.utils import extend_schema
 from rest_framework import status
+from rest_framework.generics import GenericAPIView
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from authentication.models import User
 from core.base.views import (
+    CompiledListMixin,
     UnifiedResponseListAPIView,
     UnifiedResponseListCreateAPIView,
     UnifiedResponseRetrieveUpdateDestroyAPIView,
 )
+from utils.custom_paginator import OptInCursorPaginationMixin
+from utils.exporters import stream_csv, stream_ndjson
+from utils.idempotency import idempotent
 from utils.orm_utils import query_optimizer
 
-from .events import EventsHandler
+from .events import BankEventInbox, BatchEventsHandler, EventsHandler
 from .filters import TransactionFilter, WalletFilter
 from .models import ATMCode, Transaction, Wallet
 from .serializers import (
+    BulkWalletTransferSerializer,
     TransactionSerializer,
     WalletSerializer,
     WalletTransferSerializer,
 )
+from .tasks import process_bank_events
 from .utils import NotificationOperator, TransactionOperator, verify_webhook_signature
 
 
 @extend_schema(tags=['Wallets'])
-class WalletListCreateView(UnifiedResponseListCreateAPIView):
+class WalletListCreateView(CompiledListMixin, UnifiedResponseListCreateAPIView):
     filterset_class = WalletFilter
     search_fields = ['name', 'user__phone_number']
     ordering_fields = ['created_at', 'balance']
@@ -87,7 +97,7 @@ class WalletRetrieveUpdateDestroyView(UnifiedResponseRetrieveUpdateDestroyAPIVie
         instance = self.get_object()
         if instance.is_active:
             instance.is_active = False
-            instance.save()
+            instance.save(update_fields=['is_active', 'updated_at'])
             return Response(
                 {'success': True, 'message': _("Wallet has been successfully deactivated."), 'data': None},
                 status=status.HTTP_204_NO_CONTENT,
@@ -100,7 +110,7 @@ class WalletRetrieveUpdateDestroyView(UnifiedResponseRetrieveUpdateDestroyAPIVie
 
 
 @extend_schema(tags=['Wallets'])
-class TransactionListView(UnifiedResponseListAPIView):
+class TransactionListView(CompiledListMixin, OptInCursorPaginationMixin, UnifiedResponseListAPIView):
     filterset_class = TransactionFilter
     serializer_class = TransactionSerializer
     search_fields = ['reference', 'wallet__user__phone_number', 'related_wallet__user__phone_number']
@@ -112,8 +122,61 @@ class TransactionListView(UnifiedResponseListAPIView):
         return query_optimizer(Transaction, self.request).filter(wallet__user=self.request.user)
 
 
+@extend_schema(tags=['Wallets'])
+class TransactionExportView(GenericAPIView):
+    """
+    Streams every transaction matching the list filters as NDJSON (default) or CSV, pick one with
+    ``?export_format=``. Rows are read through a server-side cursor as plain values, so memory use
+    doesn't grow with the size of the export.
+    """
+
+    filterset_class = TransactionFilter
+    search_fields = TransactionListView.search_fields
+    ordering_fields = TransactionListView.ordering_fields
+    EXPORT_FIELDS = (
+        'id',
+        'wallet',
+        'related_wallet',
+        'amount',
+        'transaction_type',
+        'money_source',
+        'reference',
+        'status',
+        'description',
+        'extra_info',
+        'expires_at',
+        'created_at',
+        'updated_at',
+    )
+    CONTENT_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+    def get_queryset(self):
+        if self.request.user.is_staff or self.request.user.is_superuser:
+            return Transaction.objects.all()
+        return Transaction.objects.filter(wallet__user=self.request.user)
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.query_params.get('export_format', 'ndjson')
+        if export_format not in self.CONTENT_TYPES:
+            return Response(
+                {'success': False, 'message': _("export_format must be one of: ndjson, csv."), 'data': None},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        rows = (
+            self.filter_queryset(self.get_queryset())
+            .values(*self.EXPORT_FIELDS)
+            .iterator(chunk_size=settings.TRANSACTION_EXPORT_CHUNK_SIZE)
+        )
+        content = stream_ndjson(rows) if export_format == 'ndjson' else stream_csv(rows, self.EXPORT_FIELDS)
+        response = StreamingHttpResponse(content, content_type=self.CONTENT_TYPES[export_format])
+        response['Content-Disposition'] = f'attachment; filename="transactions.{export_format}"'
+        return response
+
+
 @extend_schema(tags=['Wallets-Actions'])
 class RequestATMCodeView(APIView):
+    @idempotent
     def post(self, request, *args, **kwargs):
         user = request.user
         atm_code = ATMCode.objects.create(user=user)
@@ -133,6 +196,7 @@ class RequestATMCodeView(APIView):
 class TransferMoneyView(APIView):
     serializer_class = WalletTransferSerializer
 
+    @idempotent
     def post(self, request, *args, **kwargs):
         source_wallet = request.data.get('source_wallet')
         target_wallet = request.data.get('target_wallet')
@@ -185,8 +249,52 @@ class TransferMoneyView(APIView):
         )
 
 
+@extend_schema(tags=['Wallets-Actions'])
+class BulkTransferMoneyView(APIView):
+    serializer_class = BulkWalletTransferSerializer
+
+    @idempotent
+    def post(self, request, *args, **kwargs):
+        serializer = BulkWalletTransferSerializer(data=request.data, context={'request': request})
+        if not serializer.is_valid():
+            return Response(
+                {'success': False, 'message': _("Invalid data provided."), 'errors': serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        transfers = TransactionOperator.initiate_bulk_wallet_to_wallet_transfers(serializer.validated_data['transfers'])
+
+        results = []
+        for index, transfer in enumerate(transfers):
+            if transfer['error']:
+                results.append({'index': index, 'success': False, 'message': transfer['error']})
+                continue
+            results.append(
+                {
+                    'index': index,
+                    'success': True,
+                    'source_wallet': transfer['source_wallet'].id,
+                    'target_wallet': transfer['target_wallet'].id,
+                    'amount': str(transfer['amount']),
+                    'reference': transfer['reference'],
+                }
+            )
+
+        initiated = sum(result['success'] for result in results)
+        return Response(
+            {
+                'success': initiated == len(results),
+                'message': _("%(initiated)s of %(total)s transfers initiated successfully.")
+                % {'initiated': initiated, 'total': len(results)},
+                'data': {'results': results},
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
 @extend_schema(tags=['Wallets-Actions'])
 class TransferActionView(APIView):
+    @idempotent
     def post(self, request, *args, **kwargs):
         reference = request.data.get('reference')
         action = request.data.get('action')
@@ -215,6 +323,7 @@ class TransferActionView(APIView):
 
 @extend_schema(tags=['Wallets-Actions'])
 class CancelTransferView(APIView):
+    @idempotent
     def post(self, request, *args, **kwargs):
         reference = request.data.get('reference')
 
@@ -240,11 +349,50 @@ class BankWebhook(APIView):
     permission_classes = []
 
     def post(self, request, *args, **kwargs):
-        event = request.data
         if not verify_webhook_signature(request):
             return Response({"success": False, "message": _("Invalid signature.")}, status=status.HTTP_403_FORBIDDEN)
+        return self.handle_event(request)
+
+    @idempotent
+    def handle_event(self, request):
+        event = request.data
+        if isinstance(event, list):
+            return self.handle_events(event)
+        if BankEventInbox.accepts(event):
+            bank_event = BankEventInbox.enqueue(event)
+            transaction.on_commit(process_bank_events.delay)
+            return Response(
+                {'success': True, 'message': _("Event accepted for processing."), 'data': {'event_id': bank_event.id}},
+                status=status.HTTP_202_ACCEPTED,
+            )
 
         events_handler = EventsHandler()
         response = events_handler.handle_event(event)
 
         return Response(response, status=(status.HTTP_200_OK if response['success'] else status.HTTP_400_BAD_REQUEST))
+
+    def handle_events(self, events):
+        if not events or len(events) > settings.BANK_WEBHOOK_MAX_EVENTS:
+            return Response(
+                {
+                    'success': False,
+                    'message': _("Send between 1 and %(max)s events per request.")
+                    % {'max': settings.BANK_WEBHOOK_MAX_EVENTS},
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        results = BatchEventsHandler(settings.BANK_EVENTS_BATCH_SIZE).handle_events(events)
+        if any('event_id' in result for result in results):
+            transaction.on_commit(process_bank_events.delay)
+
+        succeeded = sum(result['success'] for result in results)
+        return Response(
+            {
+                'success': succeeded == len(results),
+                'message': _("%(succeeded)s of %(total)s events processed successfully.")
+                % {'succeeded': succeeded, 'total': len(results)},
+                'data': {'results': [{'index': index, **result} for index, result in enumerate(results)]},
+            },
+            status=status.HTTP_200_OK,
+        )